@@ -4,7 +4,24 @@
 
 import random
 import math
-import copy
+import itertools
+import json
+import multiprocessing
+import os
+import pickle
+import platform
+import statistics
+import struct
+import time
+import types
+import datetime
+from collections import deque
+
+# NumPy is only needed to encode game states as arrays, see StateEncoder
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class Card:
@@ -13,6 +30,10 @@ class Card:
     def __init__(self, n):
         self.name = n
 
+        # Pile the card is currently in, kept up to date by the Pile methods
+        self.current_pile = None
+        self.current_position = 0
+
     def __repr__(self):
         return "<Card: %s>" % self.name
 
@@ -96,27 +117,36 @@ class InnovationCard(Card):
 
         self.icons = [self.icon_0, self.icon_1, self.icon_2, self.icon_3]
 
+        # Icons the card adds to a stack's totals, counted once when the card is created. top_icons are the icons
+        # shown when it is the top card. splayed_icons are the icons shown when it is under the top card, indexed by
+        # the stack's splay (none, left, right, up). Splayed left shows icon 3, right shows icons 0 and 1, up shows
+        # icons 1, 2, and 3.
+        self.top_icons = self.count_icons_in_positions([0, 1, 2, 3])
+        self.splayed_icons = [self.count_icons_in_positions([]),
+                              self.count_icons_in_positions([3]),
+                              self.count_icons_in_positions([0, 1]),
+                              self.count_icons_in_positions([1, 2, 3])]
+
         # Add in event texts
         self.effect_text_0 = t0
         self.effect_text_1 = t1
         self.effect_text_2 = t2
 
-    def count_icons_on_card(self, icon_type):
-        total_icons = 0
-        for icon in self.icons:
-            if icon == icon_type:
-                total_icons += 1
+    def count_icons_in_positions(self, positions):
+        """Returns a list of the total icons of each type in the given icon positions"""
+        total_icons = [0, 0, 0, 0, 0, 0]
+        for position in positions:
+            icon = self.icons[position]
+            if icon is not None:
+                total_icons[icon] += 1
 
         return total_icons
 
-    def contains_icon(self, icon_type):
-        contains_icon = False
-        for icon in self.icons:
-            if icon == icon_type:
-                contains_icon = True
-                break
+    def count_icons_on_card(self, icon_type):
+        return self.top_icons[icon_type]
 
-        return contains_icon
+    def contains_icon(self, icon_type):
+        return self.top_icons[icon_type] > 0
 
 
 class SpecialAchievementCard(Card):
@@ -127,9 +157,6 @@ class SpecialAchievementCard(Card):
         self.criteria_text = c
         self.alternative_text = a
 
-        self.current_pile = None
-        self.current_position = 0
-
 
 class Test:
 
@@ -231,12 +258,19 @@ class Effect:
 
 
 class Pile:
-    """Base class for a collection of card objects"""
+    """Base class for a collection of card objects. Cards are held in a deque with the top card at index 0, so adding
+    or removing at either end of the pile does not shift the rest of the cards."""
 
     def __init__(self, n, seed, card_list=[]):
         self.name = n
         self.seed = seed
-        self.cards = []
+        # Random stream for shuffling, only created when the pile is first shuffled
+        self.random = None
+        self.cards = deque()
+
+        # Game the pile belongs to, set when the pile is added to a game
+        self.game = None
+
         for card in card_list:
             self.add_card_to_bottom(card)
 
@@ -244,21 +278,54 @@ class Pile:
         """Adds a card to the top of a pile"""
         if isinstance(card_object, Card):
             self.cards.append(card_object)
+            card_object.current_pile = self
+            self.state_changed('bottom', card_object.name)
+            if self.game is not None and self.game.journal_active:
+                self.game.journal.append((self.remove_card, card_object))
         else:
             raise ValueError("Could not add card " + str(card_object) + " to bottom of card pile " + str(self) + ".")
 
     def add_card_to_top(self, card_object):
         """Adds a card to the bottom of a pile"""
         if isinstance(card_object, Card):
-            self.cards.insert(0, card_object)
+            self.cards.appendleft(card_object)
+            card_object.current_pile = self
+            self.state_changed('top', card_object.name)
+            if self.game is not None and self.game.journal_active:
+                self.game.journal.append((self.remove_card, card_object))
         else:
             raise ValueError("Could not add card " + str(card_object) + " to top of card pile " + str(self) + ".")
 
     def remove_card(self, c):
+        if self.game is not None and self.game.journal_active and c in self.cards:
+            self.game.journal.append((self.insert_card, c, self.cards.index(c)))
         try:
             self.cards.remove(c)
         except ValueError:
             raise ValueError("Could not remove card " + str(c) + " from card pile " + str(self) + ".")
+        c.current_pile = None
+        self.state_changed('remove', c.name)
+
+    def insert_card(self, card_object, index):
+        """Puts a card back at a position in the pile. Used to undo removing it."""
+        self.cards.insert(index, card_object)
+        card_object.current_pile = self
+        self.state_changed('order')
+
+    def set_card_order(self, card_list):
+        """Sets the order of the cards in the pile. Used to undo a shuffle."""
+        self.cards = deque(card_list)
+        self.state_changed('order')
+
+    def replace_cards(self, card_list):
+        """Puts these cards in the pile, in this order, in place of the ones it has. Cards taken out are left in no
+        pile, so every pile they move between has to be replaced."""
+        if self.game is not None and self.game.journal_active:
+            self.game.journal.append((self.replace_cards, list(self.cards)))
+        self.cards = deque(card_list)
+        for card in self.cards:
+            card.current_pile = self
+        self.state_changed('order')
 
     def get_card(self, n):
         card = None
@@ -268,10 +335,7 @@ class Pile:
         return card
 
     def is_card_in_pile(self, card):
-        if card in self.cards:
-            return True
-        else:
-            return False
+        return card.current_pile is self
 
     def are_multiple_cards_in_pile(self, card_list):
         results = []
@@ -290,12 +354,20 @@ class Pile:
 
     def get_top_card(self):
         if len(self.cards):
-            card = self.cards.pop(0)
+            card = self.cards.popleft()
+            card.current_pile = None
+            self.state_changed('remove', card.name)
+            if self.game is not None and self.game.journal_active:
+                self.game.journal.append((self.add_card_to_top, card))
             return card
 
     def get_bottom_card(self):
         if len(self.cards):
-            card = self.cards.pop(-1)
+            card = self.cards.pop()
+            card.current_pile = None
+            self.state_changed('remove', card.name)
+            if self.game is not None and self.game.journal_active:
+                self.game.journal.append((self.add_card_to_bottom, card))
             return card
 
     def see_top_card(self):
@@ -306,15 +378,36 @@ class Pile:
         if len(self.cards) > 0:
             return self.cards[-1]
 
+    def get_cards_under_top_card(self):
+        """Returns an iterator over every card in the pile except the top card"""
+        return itertools.islice(self.cards, 1, None)
+
     def get_top_card_value(self):
         top_card_value = 0
         if self.see_top_card():
             top_card_value = self.see_top_card().age
         return top_card_value
 
+    def set_seed(self, seed):
+        """Restarts the pile's own random stream from the seed"""
+        self.seed = seed
+        self.random = None
+
     def shuffle_pile(self):
-        random.seed(self.seed)
-        random.shuffle(self.cards)
+        if self.random is None:
+            self.random = random.Random(self.seed)
+        if self.game is not None and self.game.journal_active:
+            self.game.journal.append((self.set_card_order, list(self.cards)))
+            self.game.journal_random(self.random)
+        self.random.shuffle(self.cards)
+        self.state_changed('order')
+
+    def state_changed(self, change, value=None):
+        """Tells the game that the pile has changed. Change is 'top', 'bottom' or 'remove' with a card name as the
+        value, 'order' with no value, or 'splay' with the new splay direction."""
+        if self.game is not None:
+            self.game.state_version += 1
+            self.game.pile_state_history.record(self, change, value)
 
     def highest_card_value(self):
         highest_value = 0
@@ -356,6 +449,9 @@ class Pile:
 class InnovationStack(Pile):
     """Class for an Innovation stack on a board"""
 
+    # Splay directions, in the order used for the stack's splay number
+    splay_options = ['none', 'left', 'right', 'up']
+
     def __init__(self, n, c, seed):
         Pile.__init__(self, n, seed, [])
 
@@ -367,104 +463,158 @@ class InnovationStack(Pile):
             if c == color:
                 self.color = color_options.index(c)
 
-        self.splay_left = False
-        self.splay_right = False
-        self.splay_up = False
+        # Splay as an index into splay_options
+        self.splay = 0
+
+        # Icon totals for the stack, updated every time the cards or splay change. The owner is the player whose
+        # board the stack is on, and their icon totals are kept in step with the stack's.
+        self.icon_totals = [0, 0, 0, 0, 0, 0]
+        self.owner = None
+
+        # Running sums of the icons the cards under the top card would show, one list for each splay direction
+        self.splayed_icon_sums = [[0, 0, 0, 0, 0, 0] for _ in self.splay_options]
+
+    def add_card_to_bottom(self, card_object):
+        stack_was_empty = not self.cards
+        Pile.add_card_to_bottom(self, card_object)
+        if not stack_was_empty:
+            self.adjust_splayed_icon_sums(card_object, 1)
+        self.update_icon_totals()
+
+    def add_card_to_top(self, card_object):
+        old_top_card = self.see_top_card()
+        Pile.add_card_to_top(self, card_object)
+        if old_top_card:
+            self.adjust_splayed_icon_sums(old_top_card, 1)
+        self.update_icon_totals()
+
+    def remove_card(self, c):
+        removing_top_card = bool(self.cards) and self.cards[0] is c
+        Pile.remove_card(self, c)
+        if not removing_top_card:
+            self.adjust_splayed_icon_sums(c, -1)
+        elif self.cards:
+            self.adjust_splayed_icon_sums(self.cards[0], -1)
+        self.update_icon_totals()
+
+    def insert_card(self, card_object, index):
+        if index == 0:
+            self.add_card_to_top(card_object)
+        else:
+            Pile.insert_card(self, card_object, index)
+            self.adjust_splayed_icon_sums(card_object, 1)
+            self.update_icon_totals()
+
+    def get_top_card(self):
+        card = Pile.get_top_card(self)
+        if self.cards:
+            self.adjust_splayed_icon_sums(self.cards[0], -1)
+        self.update_icon_totals()
+        return card
+
+    def get_bottom_card(self):
+        pile_size = self.get_pile_size()
+        card = Pile.get_bottom_card(self)
+        if pile_size > 1:
+            self.adjust_splayed_icon_sums(card, -1)
+        self.update_icon_totals()
+        return card
 
     def set_splay(self, splay_direction):
         """Takes splay direction as input, sets splay in that direction"""
-        splay_options = ['left', 'right', 'up']
-        if splay_direction not in splay_options:
+        if splay_direction not in ['left', 'right', 'up']:
             raise ValueError("Error setting splay. Splay must be left, right, or up.")
 
-        self.cancel_splay()
+        old_splay = self.splay
+        self.splay = 0
         if len(self.cards) > 1:
-            if splay_direction == 'left':
-                self.splay_left = True
-            elif splay_direction == 'right':
-                self.splay_right = True
-            elif splay_direction == 'up':
-                self.splay_up = True
+            self.splay = self.splay_options.index(splay_direction)
+        if self.splay != old_splay:
+            self.state_changed('splay', self.get_splay_type())
+            if self.game is not None and self.game.journal_active:
+                self.game.journal.append((self.restore_splay, old_splay))
+        self.update_icon_totals()
 
     def cancel_splay(self):
-        """Sets all splays to false"""
-        self.splay_left = False
-        self.splay_right = False
-        self.splay_up = False
+        """Removes any splay from the stack"""
+        if self.splay != 0:
+            if self.game is not None and self.game.journal_active:
+                self.game.journal.append((self.restore_splay, self.splay))
+            self.splay = 0
+            self.state_changed('splay', 'none')
+        self.update_icon_totals()
+
+    def restore_splay(self, splay):
+        """Sets the splay back to an index into splay_options. Used to undo a splay change."""
+        self.splay = splay
+        self.state_changed('splay', self.get_splay_type())
+        self.update_icon_totals()
 
     def contains_icon(self, icon_type):
-        if self.count_icons_in_stack(icon_type) > 0:
+        if self.icon_totals[icon_type] > 0:
             return True
         else:
             return False
 
-    def count_icons_in_stack(self, icon_type):
-        """Gets the total number of icons of a type in a stack"""
-        total_icons = 0
-        pile_size = self.get_pile_size()
-
-        # If there are no cards in the stack, return 0.
-        if pile_size == 0:
-            return total_icons
-
-        # Add the icons for the top card
-        card = self.cards[0]
-        total_icons = card.count_icons_on_card(icon_type)
+    def adjust_splayed_icon_sums(self, card, sign):
+        """Adds (sign 1) or removes (sign -1) a card under the top card from the running splayed icon sums"""
+        for splay in range(1, len(self.splay_options)):
+            splayed_icons = card.splayed_icons[splay]
+            sums = self.splayed_icon_sums[splay]
+            for icon in range(6):
+                sums[icon] += sign * splayed_icons[icon]
+
+    def rebuild_icon_totals(self):
+        """Recounts the splayed icon sums from the cards in the stack. Used when the order of the cards is set
+        directly instead of through the pile functions."""
+        self.splayed_icon_sums = [[0, 0, 0, 0, 0, 0] for _ in self.splay_options]
+        for card in self.get_cards_under_top_card():
+            self.adjust_splayed_icon_sums(card, 1)
+        self.update_icon_totals()
+
+    def update_icon_totals(self):
+        """Sets the stack's icon totals from the top card and the splayed icon sums, and applies the change to the
+        owning player's totals"""
+        if self.cards:
+            top_icons = self.cards[0].top_icons
+            splayed_icons = self.splayed_icon_sums[self.splay]
+            new_totals = [top_icons[icon] + splayed_icons[icon] for icon in range(6)]
+        else:
+            new_totals = [0, 0, 0, 0, 0, 0]
 
-        # Add in additional icons if the stack is splayed
-        if pile_size > 1:
-            if self.splay_left:
-                for card in self.cards[1:]:
-                    if card.icon_3 == icon_type:
-                        total_icons += 1
-            elif self.splay_right:
-                for card in self.cards[1:]:
-                    if card.icon_0 == icon_type:
-                        total_icons += 1
-                    if card.icon_1 == icon_type:
-                        total_icons += 1
-            elif self.splay_up:
-                for card in self.cards[1:]:
-                    if card.icon_1 == icon_type:
-                        total_icons += 1
-                    if card.icon_2 == icon_type:
-                        total_icons += 1
-                    if card.icon_3 == icon_type:
-                        total_icons += 1
+        if self.owner:
+            for icon in range(6):
+                self.owner.icon_totals[icon] += new_totals[icon] - self.icon_totals[icon]
+        self.icon_totals = new_totals
 
-        return total_icons
+    def count_icons_in_stack(self, icon_type):
+        """Gets the total number of icons of a type in a stack"""
+        return self.icon_totals[icon_type]
 
     def total_icons_in_stack(self):
         """Counts all icons in a stack and returns a list"""
-        icon_list = [0, 1, 2, 3, 4, 5]
-        total_icons = []
-
-        for icon in icon_list:
-            total_icons.append(self.count_icons_in_stack(icon))
-
-        return total_icons
+        return list(self.icon_totals)
 
     def get_splay_type(self):
-        if self.splay_left and not self.splay_right and not self.splay_up:
-            return 'left'
-        elif not self.splay_left and self.splay_right and not self.splay_up:
-            return 'right'
-        elif not self.splay_left and not self.splay_right and self.splay_up:
-            return 'up'
-        if not self.splay_left and not self.splay_right and not self.splay_up:
-            return 'none'
-        else:
-            raise ValueError("Multiple splay types")
+        return self.splay_options[self.splay]
+
 
 class Player:
     """Base class for a player in a game"""
 
     def __init__(self, n):
         self.name = n
+        self.seed = None
+        self.random = random.Random()
 
     def __repr__(self):
         return "<Player: %s>" % self.name
 
+    def set_seed(self, seed):
+        """Restarts the player's own random stream from the seed. Used by AIs for their random choices."""
+        self.seed = seed
+        self.random.seed(seed)
+
     def __str__(self):
         return self.name
 
@@ -496,9 +646,19 @@ class InnovationPlayer(Player):
         self.yellow_stack = s_yellow
         self.stacks = [self.blue_stack, self.green_stack, self.purple_stack, self.red_stack, self.yellow_stack]
 
+        # Icon totals across the board. Each stack updates these whenever its own totals change.
+        self.icon_totals = [0, 0, 0, 0, 0, 0]
+        for stack in self.stacks:
+            stack.owner = self
+            for icon in range(6):
+                self.icon_totals[icon] += stack.icon_totals[icon]
+
         self.action_options = []
         self.selected_action = None
         self.select_an_action = s_action
+        # Optional faster action select function that picks from a list of legal action numbers instead of Action
+        # objects, see InnovationGame.get_legal_action_numbers
+        self.select_an_action_number = None
 
         self.options = []
         self.selected_option_log = []
@@ -512,27 +672,16 @@ class InnovationPlayer(Player):
 
     def total_icons_on_board(self):
         """Returns a list of the total icons a player has of each type"""
-        total_icons = []
-        icons = [0, 1, 2, 3, 4, 5]
-
-        for icon in icons:
-            total_icons.append(self.count_icons_on_board(icon))
-
-        return total_icons
+        return list(self.icon_totals)
 
     def count_icons_on_board(self, icon_type):
         """Counts all icons of a specific type on a board"""
-        total_icons = 0
-        all_stacks = [self.blue_stack, self.green_stack, self.purple_stack, self.red_stack, self.yellow_stack]
-        for stack in all_stacks:
-            total_icons = total_icons + stack.count_icons_in_stack(icon_type)
-
-        return total_icons
+        return self.icon_totals[icon_type]
 
     def count_colors_with_one_or_more_icon(self, icon_type):
         colors_with_icon = 0
         for stack in self.stacks:
-            if stack.count_icons_in_stack(icon_type) > 0:
+            if stack.icon_totals[icon_type] > 0:
                 colors_with_icon += 1
         return colors_with_icon
 
@@ -727,6 +876,729 @@ class ScoreOption(Option):
         self.cards = c
 
 
+class PileStateHistory:
+    """Log of every change to a game's piles, used to rebuild the pile state at any earlier point.
+
+    Each change to a pile is recorded as one small event. Every keyframe_interval events, and once the game has been
+    created, a keyframe copy of every pile is stored, so rebuilding only has to replay the events since the nearest
+    keyframe. Retention is 'off' (nothing is recorded), 'ring' (only the most recent ring_size events are
+    kept, the default), or 'full' (everything is kept, for games that are replayed from the start)."""
+
+    def __init__(self, game, retention='ring', ring_size=2000, keyframe_interval=200):
+        retention_options = ['off', 'ring', 'full']
+        if retention not in retention_options:
+            raise ValueError("Error creating pile state history. Retention must be off, ring, or full.")
+        if not isinstance(ring_size, int) or ring_size < keyframe_interval:
+            raise ValueError("Error creating pile state history. Ring size must be an int of at least the "
+                             "keyframe interval.")
+
+        self.game = game
+        self.retention = retention
+        self.ring_size = ring_size
+        self.keyframe_interval = keyframe_interval
+        self.recording = retention != 'off'
+
+        # Total events recorded since the history was created. Events are numbered from 0.
+        self.event_count = 0
+        if retention == 'ring':
+            self.events = deque(maxlen=ring_size)
+            self.marks = deque(maxlen=ring_size)
+        else:
+            self.events = []
+            self.marks = []
+
+        # Event number -> (pile state, splay state) after that many events
+        self.keyframes = {}
+
+    def record(self, pile, change, value=None):
+        """Adds an event for a change to a pile. An 'order' change stores the name of every card in the pile."""
+        if not self.recording:
+            return
+
+        if change == 'order':
+            value = tuple(card.name for card in pile.cards)
+        self.events.append((pile.name, change, value))
+        self.event_count += 1
+        if self.event_count % self.keyframe_interval == 0:
+            self.take_keyframe()
+
+    def take_keyframe(self):
+        """Stores a copy of every pile and splay as they are now"""
+        if not self.recording:
+            return
+
+        pile_state = {}
+        splay_state = {}
+        for pile in self.game.piles:
+            pile_state[pile.name] = [card.name for card in pile.cards]
+            if isinstance(pile, InnovationStack):
+                splay_state[pile.name] = pile.get_splay_type()
+        self.keyframes[self.event_count] = (pile_state, splay_state)
+
+        # Keyframes from before the oldest kept event can no longer be replayed forward
+        if self.retention == 'ring':
+            first_event = self.get_first_event_number()
+            for event_number in [n for n in self.keyframes if n < first_event]:
+                del self.keyframes[event_number]
+
+    def add_mark(self, label):
+        """Records that a point in the game (the beginning of an action, effect, etc.) happened at the current event
+        number, and returns the event number"""
+        if self.recording:
+            self.marks.append((label, self.event_count))
+        return self.event_count
+
+    def get_first_event_number(self):
+        return self.event_count - len(self.events)
+
+    def rebuild(self, event_number=None):
+        """Returns (pile state, splay state) as they were after the given number of events. Defaults to now."""
+        if event_number is None:
+            event_number = self.event_count
+        if not self.recording:
+            raise ValueError("Could not rebuild pile state. Pile state history is off.")
+        if not (0 <= event_number <= self.event_count):
+            raise ValueError("Could not rebuild pile state. Event {e} has not happened.".format(e=event_number))
+
+        first_event = self.get_first_event_number()
+        keyframe_numbers = [n for n in self.keyframes if first_event <= n <= event_number]
+        if not keyframe_numbers:
+            raise ValueError("Could not rebuild pile state. Event {e} is no longer kept.".format(e=event_number))
+        keyframe_number = max(keyframe_numbers)
+
+        keyframe_piles, keyframe_splays = self.keyframes[keyframe_number]
+        pile_state = {name: list(cards) for name, cards in keyframe_piles.items()}
+        splay_state = dict(keyframe_splays)
+
+        for i in range(keyframe_number - first_event, event_number - first_event):
+            pile_name, change, value = self.events[i]
+            cards = pile_state.setdefault(pile_name, [])
+            if change == 'top':
+                cards.insert(0, value)
+            elif change == 'bottom':
+                cards.append(value)
+            elif change == 'remove':
+                cards.remove(value)
+            elif change == 'order':
+                pile_state[pile_name] = list(value)
+            elif change == 'splay':
+                splay_state[pile_name] = value
+
+        return pile_state, splay_state
+
+    def get_pile_state(self, event_number=None):
+        """Returns the pile state, in the same form as InnovationGame.get_pile_state, after the given number of events"""
+        return self.rebuild(event_number)[0]
+
+    def get_splay_state(self, event_number=None):
+        """Returns a dictionary of stack name to splay direction after the given number of events"""
+        return self.rebuild(event_number)[1]
+
+    def __len__(self):
+        return len(self.events)
+
+
+class GameLog:
+    """Structured log of game events, split into categories that each have a level.
+
+    Every category has a flag attribute of the same name (game_log.card, game_log.turn, ...) that is True when events
+    in that category will be written. Callers check the flag before calling event, so a disabled category costs a
+    single attribute check and the message is never formatted. Events go to stdout, or to a buffered file of JSON
+    lines when a file sink is set."""
+
+    levels = {'debug': 10, 'info': 20}
+
+    # Category -> level of the events in that category
+    categories = {'turn': 'info',
+                  'action': 'info',
+                  'effect': 'info',
+                  'option': 'debug',
+                  'card': 'debug',
+                  'result': 'info',
+                  'test': 'info',
+                  'search': 'debug'}
+
+    def __init__(self, active=True, level='debug'):
+        self.active = active
+        self.level = level
+        self.disabled_categories = set()
+        self.file = None
+
+        self.turn = False
+        self.action = False
+        self.effect = False
+        self.option = False
+        self.card = False
+        self.result = False
+        self.test = False
+        self.search = False
+        self.update_flags()
+
+    def update_flags(self):
+        """Sets the flag for each category from whether the log is active, the level, and the disabled categories"""
+        if self.level not in self.levels:
+            raise ValueError("Error setting log level. Level must be one of: " + ', '.join(self.levels) + ".")
+
+        for category, category_level in self.categories.items():
+            enabled = self.active and category not in self.disabled_categories and \
+                      self.levels[category_level] >= self.levels[self.level]
+            setattr(self, category, enabled)
+
+    def set_active(self, active):
+        self.active = active
+        self.update_flags()
+
+    def set_level(self, level):
+        if level not in self.levels:
+            raise ValueError("Error setting log level. Level must be one of: " + ', '.join(self.levels) + ".")
+        self.level = level
+        self.update_flags()
+
+    def enable_category(self, category):
+        if category not in self.categories:
+            raise ValueError("Could not enable log category " + str(category) + ".")
+        self.disabled_categories.discard(category)
+        self.update_flags()
+
+    def disable_category(self, category):
+        if category not in self.categories:
+            raise ValueError("Could not disable log category " + str(category) + ".")
+        self.disabled_categories.add(category)
+        self.update_flags()
+
+    def set_file_sink(self, file_name, buffer_size=1048576):
+        """Writes events to a file as JSON lines instead of printing them"""
+        self.close()
+        self.file = open(file_name, 'a', buffering=buffer_size)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def event(self, category, message, **fields):
+        """Writes an event. The message is only formatted with the fields once it is known to be written."""
+        if category not in self.categories:
+            raise ValueError("Could not write event in log category " + str(category) + ".")
+        if not getattr(self, category):
+            return
+
+        text = message.format(**fields) if fields else message
+        if self.file:
+            record = {'category': category,
+                      'level': self.categories[category],
+                      'message': text,
+                      'fields': {key: str(value) for key, value in fields.items()}}
+            self.file.write(json.dumps(record) + '\n')
+        else:
+            print(text)
+
+
+class EffectProfiler:
+    """Opt-in per effect counters: calls, cumulative and max wall time, card moves, and options offered.
+
+    Enabling the profiler gives each effect, pile and the game's select_option an instance level replacement that
+    counts as it goes. Disabling removes them again, so effects run through the plain Effect.activate and cost
+    nothing extra. Times and counts of an effect include any effects it runs itself, such as Computers running a
+    dogma for the player."""
+
+    # Columns of each row
+    columns = ['calls', 'total_time', 'max_time', 'card_moves', 'options_offered']
+
+    def __init__(self, game):
+        self.game = game
+        self.enabled = False
+
+        # Effect name -> [calls, total time, max time, card moves, options offered]
+        self.rows = {}
+
+        # Running totals, compared before and after each effect
+        self.card_moves = 0
+        self.options_offered = 0
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        for effect in self.game.effects:
+            effect.activate = self.profile_effect(effect)
+        for pile in self.game.piles:
+            pile.state_changed = self.count_card_moves(pile.state_changed)
+        self.game.select_option = self.count_options_offered(self.game.select_option)
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        for effect in self.game.effects:
+            del effect.activate
+        for pile in self.game.piles:
+            del pile.state_changed
+        del self.game.select_option
+
+    def reset(self):
+        self.rows = {}
+
+    def profile_effect(self, effect):
+        def activate():
+            card_moves = self.card_moves
+            options_offered = self.options_offered
+            start = time.perf_counter()
+            effect.function()
+            elapsed = time.perf_counter() - start
+
+            row = self.rows.get(effect.name)
+            if row is None:
+                row = self.rows[effect.name] = [0, 0.0, 0.0, 0, 0]
+            row[0] += 1
+            row[1] += elapsed
+            row[2] = max(row[2], elapsed)
+            row[3] += self.card_moves - card_moves
+            row[4] += self.options_offered - options_offered
+
+        return activate
+
+    def count_card_moves(self, state_changed):
+        def counted_state_changed(change, value=None):
+            if change == 'top' or change == 'bottom':
+                self.card_moves += 1
+            state_changed(change, value)
+
+        return counted_state_changed
+
+    def count_options_offered(self, select_option):
+        def counted_select_option():
+            self.options_offered += len(self.game.active_player.options)
+            select_option()
+
+        return counted_select_option
+
+    def merge(self, rows):
+        """Adds rows from another profiler, for example one from another worker process"""
+        for name, other_row in rows.items():
+            row = self.rows.get(name)
+            if row is None:
+                self.rows[name] = list(other_row)
+            else:
+                row[0] += other_row[0]
+                row[1] += other_row[1]
+                row[2] = max(row[2], other_row[2])
+                row[3] += other_row[3]
+                row[4] += other_row[4]
+
+    def get_table(self):
+        """Returns the rows as lines of text, slowest effect in total first"""
+        lines = ["{n:<28} {c:>9} {t:>10} {a:>9} {m:>9} {v:>10} {o:>9}".format(
+            n='Effect', c='Calls', t='Total ms', a='Mean us', m='Max ms', v='Card moves', o='Options')]
+        for name, row in sorted(self.rows.items(), key=lambda item: item[1][1], reverse=True):
+            lines.append("{n:<28} {c:>9} {t:>10.1f} {a:>9.1f} {m:>9.2f} {v:>10} {o:>9}".format(
+                n=name, c=row[0], t=1000 * row[1], a=1000000 * row[1] / row[0], m=1000 * row[2], v=row[3], o=row[4]))
+        return lines
+
+
+class SearchNode:
+    """Decision point in the tree of a Monte Carlo tree search: an action, or an option offered during an effect.
+
+    The key identifies the decision, and the player is the one who makes it. The statistics of each choice are kept
+    on the node it is made from: how often it was tried, and the games the deciding player won after it, a tie
+    counting as half. Children are the decisions reached after each choice, by choice and then by the player and
+    choices of the decision, since hidden cards can lead the same choice to different decisions."""
+
+    def __init__(self):
+        self.key = None
+        self.player_number = None
+        self.choices = None
+        self.untried_choices = []
+        self.children = {}
+        self.visits = 0
+        self.choice_visits = {}
+        self.choice_wins = {}
+
+    def set_decision(self, key, player_number, choices):
+        self.key = key
+        self.player_number = player_number
+        self.choices = list(choices)
+        self.untried_choices = list(choices)
+        self.children = {}
+        self.visits = 0
+        self.choice_visits = {choice: 0 for choice in choices}
+        self.choice_wins = {choice: 0 for choice in choices}
+
+    def get_ucb_choice(self, exploration):
+        """Returns the tried choice with the highest UCB1 score"""
+        log_visits = math.log(self.visits)
+        best_choice = None
+        best_score = -1
+        for choice in self.choices:
+            visits = self.choice_visits[choice]
+            score = self.choice_wins[choice] / visits + exploration * math.sqrt(log_visits / visits)
+            if score > best_score:
+                best_choice = choice
+                best_score = score
+        return best_choice
+
+    def get_most_visited_choice(self):
+        return max(self.choices, key=lambda choice: self.choice_visits[choice])
+
+    def find_node(self, key):
+        """Returns the node in this subtree with the key, or None"""
+        nodes = deque([self])
+        while nodes:
+            node = nodes.popleft()
+            if node.key == key:
+                return node
+            for children in node.children.values():
+                nodes.extend(children.values())
+        return None
+
+    def count_nodes(self):
+        """Number of nodes in this subtree"""
+        count = 0
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            count += 1
+            for children in node.children.values():
+                nodes.extend(children.values())
+        return count
+
+
+class StateEncoder:
+    """Encodes states of an Innovation game as fixed size NumPy arrays, for training an AI.
+
+    States are read from save_state bytes, so a batch of states is encoded with a few array operations and no Python
+    loop over cards. The arrays are allocated once with allocate and filled in place. Players are ordered from the
+    perspective player, who is always first, and only the perspective player's hand shows which cards are in it. The
+    other hands show how many cards of each age they hold, as the backs of the cards do.
+
+    icons         (batch, players, 6)   visible icons of each type
+    top_cards     (batch, players, 5)   card number + 1 of the top card of each color, 0 if the stack is empty
+    splays        (batch, players, 5)   splay of each color, as an index into InnovationStack.splay_options
+    scores        (batch, players)      score
+    achievements  (batch, players)      number of achievements
+    hand_ages     (batch, players, 10)  number of cards of each age in hand
+    hand          (batch, cards)        1 for each card in the perspective player's hand
+    draw_piles    (batch, 10)           number of cards left in each draw pile
+    actions_left  (batch,)              actions the turn player has left after the current one"""
+
+    # Kinds of pile a card can be in
+    other_pile = 0
+    hand_pile = 1
+    score_pile = 2
+    achievement_pile = 3
+    stack_pile = 4
+    draw_pile = 5
+
+    def __init__(self, game):
+        if numpy is None:
+            raise ImportError("Could not create state encoder. NumPy is not installed.")
+
+        self.number_of_players = len(game.players)
+        self.number_of_cards = len(game.cards)
+        self.state_size = game.get_state_struct().size
+        self.header_size = struct.calcsize(game.state_header_format)
+        # Actions left in the turn is the last byte of the header
+        self.actions_left_offset = self.header_size - 1
+        self.splay_offset = self.header_size + 2 * self.number_of_players
+        self.card_offset = self.splay_offset + len(game.stacks)
+
+        # Tables indexed by pile number. Cards that are in no pile have pile number 255.
+        self.pile_kinds = numpy.zeros(256, dtype=numpy.int8)
+        self.pile_owners = numpy.zeros(256, dtype=numpy.int8)
+        self.pile_colors = numpy.zeros(256, dtype=numpy.int8)
+        self.pile_stacks = numpy.zeros(256, dtype=numpy.int16)
+        self.pile_ages = numpy.zeros(256, dtype=numpy.int8)
+        player_numbers = {player: number for number, player in enumerate(game.players)}
+        stack_numbers = {stack: number for number, stack in enumerate(game.stacks)}
+        for pile_number, pile in enumerate(game.piles):
+            for number, player in enumerate(game.players):
+                if pile is player.hand:
+                    self.pile_kinds[pile_number] = self.hand_pile
+                elif pile is player.score_pile:
+                    self.pile_kinds[pile_number] = self.score_pile
+                elif pile is player.achievement_pile:
+                    self.pile_kinds[pile_number] = self.achievement_pile
+                else:
+                    continue
+                self.pile_owners[pile_number] = number
+            if pile in stack_numbers:
+                self.pile_kinds[pile_number] = self.stack_pile
+                self.pile_owners[pile_number] = player_numbers[pile.owner]
+                self.pile_colors[pile_number] = pile.color
+                self.pile_stacks[pile_number] = stack_numbers[pile]
+            elif pile in game.draw_piles:
+                self.pile_kinds[pile_number] = self.draw_pile
+                self.pile_ages[pile_number] = game.draw_piles.index(pile)
+
+        # Tables indexed by card number. Special achievements have no age or icons.
+        self.card_ages = numpy.zeros(self.number_of_cards, dtype=numpy.int16)
+        self.card_top_icons = numpy.zeros((self.number_of_cards, 6), dtype=numpy.int16)
+        self.card_splayed_icons = numpy.zeros((self.number_of_cards, len(InnovationStack.splay_options), 6),
+                                              dtype=numpy.int16)
+        for number, card in enumerate(game.cards):
+            if isinstance(card, InnovationCard):
+                self.card_ages[number] = card.age
+                self.card_top_icons[number] = card.top_icons
+                self.card_splayed_icons[number] = card.splayed_icons
+
+    def allocate(self, batch_size):
+        """Returns a dictionary of zeroed arrays for a batch of encoded states"""
+        players = self.number_of_players
+        return {'icons': numpy.zeros((batch_size, players, 6), dtype=numpy.int16),
+                'top_cards': numpy.zeros((batch_size, players, 5), dtype=numpy.int16),
+                'splays': numpy.zeros((batch_size, players, 5), dtype=numpy.int8),
+                'scores': numpy.zeros((batch_size, players), dtype=numpy.int16),
+                'achievements': numpy.zeros((batch_size, players), dtype=numpy.int8),
+                'hand_ages': numpy.zeros((batch_size, players, 10), dtype=numpy.int8),
+                'hand': numpy.zeros((batch_size, self.number_of_cards), dtype=numpy.uint8),
+                'draw_piles': numpy.zeros((batch_size, 10), dtype=numpy.int8),
+                'actions_left': numpy.zeros(batch_size, dtype=numpy.int8)}
+
+    def encode(self, game, perspective_player_number, arrays, index=0):
+        """Encodes the game's current state into one row of the arrays"""
+        rows = {name: array[index:index + 1] for name, array in arrays.items()}
+        self.encode_states([game.save_state()], [perspective_player_number], rows)
+
+    def encode_states(self, states, perspective_player_numbers, arrays):
+        """Encodes a batch of states, a list of save_state bytes or a (batch, state size) uint8 array, into the first
+        rows of the arrays"""
+        if not isinstance(states, numpy.ndarray):
+            states = numpy.frombuffer(b''.join(states), dtype=numpy.uint8).reshape(-1, self.state_size)
+        batch_size = states.shape[0]
+        players = self.number_of_players
+        perspectives = numpy.asarray(perspective_player_numbers, dtype=numpy.int64).reshape(batch_size, 1)
+        batch_numbers = numpy.arange(batch_size).reshape(batch_size, 1)
+
+        # Pile and position of every card, and who owns the pile counted from the perspective player
+        card_locations = states[:, self.card_offset:].reshape(batch_size, self.number_of_cards, 2)
+        piles = card_locations[:, :, 0]
+        positions = card_locations[:, :, 1]
+        kinds = self.pile_kinds[piles]
+        owners = (self.pile_owners[piles] - perspectives) % players
+        owner_slots = batch_numbers * players + owners
+        in_hand = kinds == self.hand_pile
+        in_score_pile = kinds == self.score_pile
+        in_stack = kinds == self.stack_pile
+
+        # Splays, reordered from the perspective player
+        splays = states[:, self.splay_offset:self.card_offset].reshape(batch_size, -1, 5)
+        player_order = (numpy.arange(players) + perspectives) % players
+        arrays['splays'][:batch_size] = splays[batch_numbers, player_order]
+
+        arrays['scores'][:batch_size] = numpy.bincount(
+            owner_slots[in_score_pile], weights=self.card_ages.reshape(1, -1).repeat(batch_size, 0)[in_score_pile],
+            minlength=batch_size * players).reshape(batch_size, players)
+        arrays['achievements'][:batch_size] = numpy.bincount(
+            owner_slots[kinds == self.achievement_pile], minlength=batch_size * players).reshape(batch_size, players)
+
+        card_numbers = numpy.broadcast_to(numpy.arange(self.number_of_cards), piles.shape)
+        ages = self.card_ages[card_numbers]
+        arrays['hand_ages'][:batch_size] = numpy.bincount(
+            (owner_slots * 10 + ages - 1)[in_hand], minlength=batch_size * players * 10).reshape(batch_size, players,
+                                                                                               10)
+        arrays['hand'][:batch_size] = in_hand & (owners == 0)
+        arrays['draw_piles'][:batch_size] = numpy.bincount(
+            (batch_numbers * 10 + self.pile_ages[piles])[kinds == self.draw_pile],
+            minlength=batch_size * 10).reshape(batch_size, 10)
+        arrays['actions_left'][:batch_size] = states[:, self.actions_left_offset]
+
+        # Top cards are at position 0 of their stack
+        top_cards = arrays['top_cards'][:batch_size]
+        top_cards[:] = 0
+        stack_slots = owners * 5 + self.pile_colors[piles]
+        is_top = in_stack & (positions == 0)
+        top_batch_numbers, top_card_numbers = numpy.nonzero(is_top)
+        top_cards.reshape(batch_size, players * 5)[top_batch_numbers, stack_slots[is_top]] = top_card_numbers + 1
+
+        # Icons: all of the top card's, and the ones the splay of the stack shows of the cards under it
+        card_splays = splays.reshape(batch_size, -1)[batch_numbers, self.pile_stacks[piles]]
+        card_icons = numpy.where(is_top[:, :, None], self.card_top_icons[card_numbers],
+                                 self.card_splayed_icons[card_numbers, card_splays])
+        card_icons *= in_stack[:, :, None]
+        player_cards = owners[:, None, :] == numpy.arange(players).reshape(1, players, 1)
+        arrays['icons'][:batch_size] = numpy.matmul(player_cards.astype(numpy.int16), card_icons)
+
+
+class TrajectoryRecorder:
+    """Records every decision, with the encoded state, legal choices, choice and outcome (1 win, 0.5 tie, 0 loss, -1
+    unfinished), into memory mapped .npy shards, see load_trajectories. Starting melds are recorded as meld actions."""
+
+    def __init__(self, game, directory, prefix='trajectories', shard_size=65536):
+        self.game = game
+        self.directory = directory
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.enabled = False
+        self.encoder = game.get_state_encoder()
+
+        fields = [(name, array.dtype, array.shape[1:]) for name, array in self.encoder.allocate(1).items()]
+        self.mask_size = game.decision_space_size
+        fields += [('player', numpy.int8),
+                   ('decision', numpy.int8),
+                   ('mask', numpy.uint8, (self.mask_size,)),
+                   ('choice', numpy.int16),
+                   ('outcome', numpy.float32),
+                   ('seed', numpy.int64),
+                   ('action_count', numpy.int32)]
+        self.dtype = numpy.dtype(fields)
+        self.encoded_fields = list(self.encoder.allocate(1))
+
+        self.shards = []
+        self.shard = None
+        self.shard_arrays = None
+        self.shard_file_name = None
+        self.records = 0
+
+        # Rows of the game being recorded, as (shard, first row, end row), so the outcome can be filled in at the end
+        self.game_rows = []
+
+        os.makedirs(directory, exist_ok=True)
+
+    # Decision kinds
+    action_decision = 0
+    option_decision = 1
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self.game.set_up_game = self.record_new_game(self.game.set_up_game)
+        self.game.select_action = self.record_starting_meld(self.game.select_action)
+        self.game.execute_action_number = self.record_action(self.game.execute_action_number)
+        self.game.execute_option = self.record_option(self.game.execute_option)
+        self.game.game_end = self.record_outcome(self.game.game_end)
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        del self.game.set_up_game
+        del self.game.select_action
+        del self.game.execute_action_number
+        del self.game.execute_option
+        del self.game.game_end
+
+    def close(self):
+        """Stops recording and writes the last shard and the index"""
+        self.disable()
+        self.close_shard()
+
+    def record_new_game(self, set_up_game):
+        def recorded_set_up_game():
+            # The records of a game that never finished stay at outcome -1
+            self.game_rows = []
+            set_up_game()
+
+        return recorded_set_up_game
+
+    def record_starting_meld(self, select_action):
+        def recorded_select_action():
+            select_action()
+            game = self.game
+            if game.round == 0:
+                player = game.turn_player
+                meld_numbers = [game.action_meld_offset + game.card_numbers[action.card.name]
+                                for action in player.action_options]
+                choice = game.action_meld_offset + game.card_numbers[player.selected_action.card.name]
+                self.add_record(self.action_decision, player, meld_numbers, choice)
+
+        return recorded_select_action
+
+    def record_action(self, execute_action_number):
+        def recorded_execute_action_number(action_number):
+            legal_action_numbers = self.game.get_legal_action_numbers()
+            self.add_record(self.action_decision, self.game.turn_player, legal_action_numbers, action_number)
+            execute_action_number(action_number)
+
+        return recorded_execute_action_number
+
+    def record_option(self, execute_option):
+        def recorded_execute_option():
+            player = self.game.active_player
+            options = player.options
+            self.add_record(self.option_decision, player, range(len(options)), options.index(player.selected_option))
+            execute_option()
+
+        return recorded_execute_option
+
+    def record_outcome(self, game_end):
+        def recorded_game_end():
+            game_end()
+            self.finish_game()
+
+        return recorded_game_end
+
+    def add_record(self, decision, player, legal_choices, choice):
+        game = self.game
+        if game.game_over:
+            # Effects can still offer options after the game has ended
+            return
+
+        if self.shard is None or self.records == self.shard_size:
+            self.open_shard()
+        row = self.records
+        shard = self.shard
+        self.encoder.encode(game, player.number, self.shard_arrays, row)
+        shard['player'][row] = player.number
+        shard['decision'][row] = decision
+        shard['mask'][row, list(legal_choices)] = 1
+        shard['choice'][row] = choice
+        shard['outcome'][row] = -1
+        shard['seed'][row] = game.seed
+        shard['action_count'][row] = game.action_count
+        self.records += 1
+
+        if self.game_rows and self.game_rows[-1][0] is self.shard:
+            self.game_rows[-1][2] = self.records
+        else:
+            self.game_rows.append([self.shard, row, self.records])
+
+    def finish_game(self):
+        """Fills in the outcome of every record of the game that just ended"""
+        winning_player = self.game.winning_player
+        for shard, first_row, end_row in self.game_rows:
+            outcomes = shard['outcome'][first_row:end_row]
+            if winning_player is None:
+                outcomes[:] = 0.5
+            else:
+                outcomes[:] = shard['player'][first_row:end_row] == winning_player.number
+        self.game_rows = []
+
+    def open_shard(self):
+        self.close_shard()
+        self.shard_file_name = self.prefix + '-' + str(len(self.shards)).zfill(5) + '.npy'
+        self.shard = numpy.lib.format.open_memmap(os.path.join(self.directory, self.shard_file_name), mode='w+',
+                                                  dtype=self.dtype, shape=(self.shard_size,))
+        self.shard_arrays = {name: self.shard[name] for name in self.encoded_fields}
+        self.records = 0
+
+    def close_shard(self):
+        """Flushes the current shard, cutting it down to its records if it is not full, and writes the index"""
+        if self.shard is None:
+            return
+        shard_path = os.path.join(self.directory, self.shard_file_name)
+        self.shard.flush()
+        if self.records < self.shard_size:
+            numpy.save(shard_path + '.part.npy', self.shard[:self.records])
+            # The records of an unfinished game stay at outcome -1. Every view of the mapping is let go, so it is
+            # closed before the file under it is replaced, which Windows does not allow while it is open.
+            self.game_rows = []
+            del self.shard_arrays
+            del self.shard
+            os.replace(shard_path + '.part.npy', shard_path)
+        self.shards.append({'file': self.shard_file_name, 'records': self.records})
+        self.shard = None
+        self.shard_arrays = None
+        self.write_index()
+
+    def write_index(self):
+        index = {'fields': self.dtype.names,
+                 'shard_size': self.shard_size,
+                 'shards': self.shards}
+        with open(os.path.join(self.directory, self.prefix + '-index.json'), 'w') as handle:
+            json.dump(index, handle)
+
+
 class Game:
     """Base class for a collection of Pile objects and players"""
 
@@ -741,7 +1613,30 @@ class Game:
         self.game_over = False
         self.round = 0
 
-        # Set the random see if not specified
+        # Dictionaries to find objects by name (or number for players). The most recently added object wins.
+        self.pile_index = {}
+        self.player_index = {}
+        self.card_index = {}
+        self.effect_index = {}
+
+        # Increases every time a card moves or a splay changes, so changes can be detected by comparing two numbers
+        self.state_version = 0
+        self.pile_state_history = PileStateHistory(self)
+
+        # Per effect profiling counters, see set_effect_profiling
+        self.effect_profiler = None
+
+        # Undo journal, see start_journal. Each record is a function and the arguments that undo one change.
+        self.journal = []
+        self.journal_active = False
+        self.journal_used_random_streams = set()
+
+        self.seed = None
+        self.set_seed(se)
+
+    def set_seed(self, se=None):
+        """Sets the game's seed, and restarts the random stream of every pile and player in the game from it.
+        Picks a random seed if not specified."""
         if se is None:
             self.seed = self.set_random_seed()
         else:
@@ -750,12 +1645,94 @@ class Game:
             else:
                 raise ValueError("Could not create game. Seed must be int between 0 and 9,999,999,999")
 
+        for pile in self.piles:
+            pile.set_seed(self.get_stream_seed(pile.name))
+        for player in self.players:
+            player.set_seed(self.get_stream_seed('player ' + str(player.number)))
+
     def set_random_seed(self):
         return random.randint(0, 9999999999)
 
+    def get_stream_seed(self, stream_name):
+        """Seed for one of the game's random streams. Each pile and player has its own stream, so drawing from one
+        never changes another, and streams do not depend on the order piles and players were added in."""
+        return str(self.seed) + ' ' + stream_name
+
+    # Undo journal
+    def start_journal(self):
+        """Starts recording how to undo every change to the game, returns a mark for the current state"""
+        self.journal = []
+        self.journal_active = True
+        return self.add_journal_mark()
+
+    def stop_journal(self):
+        self.journal = []
+        self.journal_active = False
+        self.journal_used_random_streams = set()
+
+    def add_journal_mark(self):
+        """Returns a mark the game can be rolled back to with rollback_to_journal_mark"""
+        # Random streams save their state the first time they are used after each mark
+        self.journal_used_random_streams = set()
+        return len(self.journal), self.get_turn_state()
+
+    def rollback_to_journal_mark(self, mark):
+        """Undoes every change made since the mark, latest first. Marks made after it can no longer be used."""
+        journal_length, turn_state = mark
+        if journal_length > len(self.journal):
+            raise ValueError("Could not roll back game " + str(self.name) + ". The journal mark is no longer kept.")
+
+        journal_active = self.journal_active
+        self.journal_active = False
+        while len(self.journal) > journal_length:
+            record = self.journal.pop()
+            record[0](*record[1:])
+        self.journal_active = journal_active
+
+        self.set_turn_state(turn_state)
+        self.journal_used_random_streams = set()
+
+    def set_journaled(self, game_object, attribute, value):
+        """Sets an attribute, recording the old value in the journal"""
+        if self.journal_active:
+            self.journal.append((setattr, game_object, attribute, getattr(game_object, attribute)))
+        setattr(game_object, attribute, value)
+
+    def journal_random(self, random_stream):
+        """Records the state of a random stream the first time it is used after a mark, returns the stream"""
+        if self.journal_active and random_stream not in self.journal_used_random_streams:
+            self.journal_used_random_streams.add(random_stream)
+            self.journal.append((random_stream.setstate, random_stream.getstate()))
+        return random_stream
+
+    def get_turn_state(self):
+        """State that is not changed through the journal, saved with each mark"""
+        return self.round
+
+    def set_turn_state(self, turn_state):
+        self.round = turn_state
+
+    def set_effect_profiling(self, enabled):
+        """Turns the per effect profiler on or off. Counters are kept until reset, even while it is off."""
+        if enabled:
+            if self.effect_profiler is None:
+                self.effect_profiler = EffectProfiler(self)
+            self.effect_profiler.enable()
+        elif self.effect_profiler is not None:
+            self.effect_profiler.disable()
+
+    def set_pile_state_history_retention(self, retention, ring_size=2000):
+        """Sets how much pile state history to keep: 'off', 'ring' (the most recent ring_size changes), or 'full'.
+        Any history already recorded is discarded."""
+        self.pile_state_history = PileStateHistory(self, retention, ring_size)
+        self.pile_state_history.take_keyframe()
+
     def add_pile(self, p):
         if isinstance(p, Pile):
             self.piles.append(p)
+            self.pile_index[p.name] = p
+            p.game = self
+            p.set_seed(self.get_stream_seed(p.name))
         else:
             raise ValueError("Could not add pile " + str(p) + " to card game " + str(self.name) + ".")
 
@@ -765,40 +1742,42 @@ class Game:
         except ValueError:
             raise ValueError("Could not remove pile " + str(p) + " from card game " + str(self.name) + ".")
 
+        # If the removed pile was indexed, fall back to the most recent remaining pile with the same name
+        if self.pile_index.get(p.name) is p:
+            del self.pile_index[p.name]
+            for pile in self.piles:
+                if pile.name == p.name:
+                    self.pile_index[pile.name] = pile
+
     def get_pile_object(self, n):
-        pile = None
-        pile_list = list(filter(lambda x: x.name == n, self.piles))
-        if len(pile_list):
-            pile = pile_list.pop()
-        return pile
+        return self.pile_index.get(n)
 
     def add_player(self, p):
         if isinstance(p, Player):
             self.players.append(p)
+            self.player_index[p.number] = p
+            p.set_seed(self.get_stream_seed('player ' + str(p.number)))
         else:
             raise ValueError("Could not add player " + str(p) + " to card game " + str(self.name) + ".")
 
+    def clear_players(self):
+        self.players = []
+        self.player_index = {}
+
     def get_player_object(self, player_number):
-        player = None
-        player_list = list(filter(lambda x: x.number == player_number, self.players))
-        if len(player_list):
-            player = player_list.pop()
-        return player
+        return self.player_index.get(player_number)
 
     def add_card_to_game(self, c):
         """Adds a card object to the game's list of cards"""
         if isinstance(c, Card):
             self.cards.append(c)
+            self.card_index[c.name] = c
         else:
             raise ValueError("Could not add card " + str(c) + " to card game " + str(self.name) + ".")
 
     def get_card_object(self, card_name):
         """Given a card name (string), returns the card object"""
-        card = None
-        card_list = list(filter(lambda x: x.name == card_name, self.cards))
-        if len(card_list):
-            card = card_list.pop()
-        return card
+        return self.card_index.get(card_name)
 
     def get_cards_from_list(self, card_list):
         output_list = []
@@ -809,16 +1788,12 @@ class Game:
     def add_effect_to_game(self, e):
         if isinstance(e, Effect):
             self.effects.append(e)
+            self.effect_index[e.name] = e
         else:
             raise ValueError("Could not add effect " + str(e) + " to card game " + str(self.name) + ".")
 
     def get_effect_object(self, card, effect_number):
-        effect = None
-        effect_name = card.name + ' Effect ' + str(effect_number)
-        effect_list = list(filter(lambda x: x.name == effect_name, self.effects))
-        if len(effect_list):
-            effect = effect_list.pop()
-        return effect
+        return self.effect_index.get(card.name + ' Effect ' + str(effect_number))
 
     def add_test_to_game(self, t):
         if isinstance(t, Test):
@@ -845,6 +1820,39 @@ class Game:
 class InnovationGame(Game):
     """Class of a game of Innovation"""
 
+    # Version of the byte layout written by save_state, and the format of its header
+    state_format_version = 2
+    state_header_format = '<BBHBBBIB'
+
+    # AI policies that can be given to a player by name: the names of the action and option select functions, and of
+    # the action number select function (None if the policy only picks from Action objects)
+    ai_policies = {'random': ('ai_select_action_random', 'ai_select_random_option',
+                              'ai_select_action_number_random'),
+                   'always achieve': ('ai_select_action_random_always_achieve', 'ai_select_random_option',
+                                      'ai_select_action_number_random_always_achieve'),
+                   'always splay': ('ai_select_action_random', 'ai_select_random_option_always_splay',
+                                    'ai_select_action_number_random'),
+                   'rollout': ('ai_select_action_random', 'ai_select_random_option',
+                               'ai_select_action_number_rollout'),
+                   'mcts': ('ai_select_action_random', 'ai_select_option_mcts', 'ai_select_action_number_mcts')}
+
+    # Settings of the rollout AI: random games played on from each legal action, or if a time budget in seconds is
+    # set, as many as fit in it. With more than one worker the playouts are split over a process pool.
+    rollout_playouts = 20
+    rollout_time_budget = None
+    rollout_workers = 1
+
+    # Settings of the tree search AI: iterations of each search, or if a time budget in seconds is set, as many as fit
+    # in it, and the exploration constant of UCB1
+    mcts_iterations = 200
+    mcts_time_budget = None
+    mcts_exploration = math.sqrt(2)
+
+    # With more than one worker, the tree search is root parallel: this game searches its own tree while the other
+    # workers each search a new tree in a process pool, with the same budget and their own seeds, and the visits and
+    # wins of the actions are added up before picking one
+    mcts_workers = 1
+
     def __init__(self, n, d, num_p, se=None, p1_n='', p1_ai=False, p2_n='', p2_ai=False, p3_n='', p3_ai=False, p4_n='', p4_ai=False):
         Game.__init__(self, n, d, se)
 
@@ -867,6 +1875,10 @@ class InnovationGame(Game):
                                     self.ai_select_random_option,
                                     self.ai_select_random_option,
                                     self.ai_select_random_option]
+        self.ai_action_number_functions = [self.ai_select_action_number_random,
+                                           self.ai_select_action_number_random_always_achieve,
+                                           self.ai_select_action_number_random,
+                                           self.ai_select_action_number_random_always_achieve]
 
         self.active_player = None
         self.active_card = None
@@ -877,6 +1889,41 @@ class InnovationGame(Game):
         self.ordered_players = []
 
         self.winning_player = None
+        self.action_count = 0
+        self.actions_left_in_turn = 0
+
+        # Rollout AI, see ai_select_action_number_rollout
+        self.playout_random = None
+
+        # Process pool of the rollout and tree search AIs, see get_worker_pool
+        self.worker_pool = None
+        self.worker_pool_size = 0
+
+        # Tree search AI, see ai_select_action_number_mcts. The subtrees each player kept from its last search, by
+        # player number, the children of the last choice and the path of the running search, and statistics of the
+        # last search.
+        self.search_trees = {}
+        self.search_children = None
+        self.search_path = []
+        self.search_statistics = None
+
+        # Byte layout for save_state and load_state, built on first use
+        self.state_struct = None
+
+        # Encoder of states as NumPy arrays, built on first use, see get_state_encoder
+        self.state_encoder = None
+
+        # Records decisions as training data, see set_trajectory_recording
+        self.trajectory_recorder = None
+
+        # Fixed numbering of every action, set by set_action_space once the cards are created. Action numbers are:
+        # draw, achieve an achievement of each age 1-10, meld each card (by card number), dogma each color.
+        self.card_numbers = {}
+        self.action_achieve_offset = 1
+        self.action_meld_offset = 11
+        self.action_dogma_offset = 11
+        self.action_space_size = 0
+        self.option_space_size = 0
 
         # Variables for each of the icon types
         self.crown = 0
@@ -923,18 +1970,31 @@ class InnovationGame(Game):
         self.piles_at_beginning_of_action = {}
         self.piles_at_beginning_of_effect = {}
         self.piles_at_beginning_of_no_share = {}
-        self.pile_state_history = []
+        self.history_mark_at_beginning_of_action = 0
+        self.history_mark_at_beginning_of_effect = 0
+        self.history_mark_at_beginning_of_no_share = 0
+        self.state_version_at_beginning_of_effect = 0
 
         # Create everything needed for the game
-        self.verbose = True
+        self.game_log = GameLog()
         self.testing = False
         self.active_test = None
+        self.test_states = []
 
         # Play a game (Play Ball!)
         # self.create_game()
         # self.set_up_game()
         # self.play_game()
 
+    @property
+    def verbose(self):
+        """True if the game log writes anything. Setting it turns the whole game log on or off."""
+        return self.game_log.active
+
+    @verbose.setter
+    def verbose(self, value):
+        self.game_log.set_active(value)
+
     def create_game(self):
         self.create_piles()
         self.create_cards()
@@ -942,6 +2002,67 @@ class InnovationGame(Game):
         self.create_special_achievements()
         self.create_players()
         self.create_effects()
+        self.set_action_space()
+        self.save_starting_piles()
+        self.pile_state_history.take_keyframe()
+
+    def save_starting_piles(self):
+        """Saves which cards start in each pile, and in what order, so the game can be reset"""
+        self.starting_piles = []
+        for pile in self.piles:
+            if pile.cards:
+                self.starting_piles.append((pile, list(pile.cards)))
+
+    def reset_game(self, se=None):
+        """Puts a game that has already been created back to the state it was in straight after create_game, with a
+        new seed (random if not specified). Every pile, card, player, and effect is reused, so the game is ready for
+        set_up_game without reading the card lists or building any objects."""
+        # Empty every pile and put the cards back where they started
+        for card in self.cards:
+            card.current_pile = None
+        for pile in self.piles:
+            pile.cards.clear()
+        for pile, cards in self.starting_piles:
+            pile.cards.extend(cards)
+            for card in cards:
+                card.current_pile = pile
+
+        for stack in self.stacks:
+            stack.splay = 0
+            stack.rebuild_icon_totals()
+
+        for player in self.players:
+            player.icon_totals = [0, 0, 0, 0, 0, 0]
+            player.action_options = []
+            player.selected_action = None
+            player.options = []
+            player.selected_option_log = []
+            player.selected_option = None
+            player.table_position = 0
+            player.winner = False
+
+        self.game_over = False
+        self.round = 0
+        self.winning_player = None
+        self.action_count = 0
+        self.actions_left_in_turn = 0
+        self.search_trees = {}
+        self.active_player = None
+        self.active_card = None
+        self.turn_player = None
+        self.turn_card = None
+        self.effect_player = None
+        self.ordered_players = []
+
+        self.piles_at_beginning_of_action = {}
+        self.piles_at_beginning_of_effect = {}
+        self.piles_at_beginning_of_no_share = {}
+        self.stop_journal()
+        self.state_version += 1
+        self.set_pile_state_history_retention(self.pile_state_history.retention, self.pile_state_history.ring_size)
+        self.close_worker_pool()
+
+        self.set_seed(se)
 
     def create_cards(self):
         with open('cards/card_list.csv', 'r') as handle:
@@ -995,7 +2116,7 @@ class InnovationGame(Game):
         self.add_pile(Pile('reveal', self.seed))
 
     def create_players(self):
-        self.players = []
+        self.clear_players()
         for i in range(self.number_of_players):
             # Create an achievement pile, score_pile, and hand for each player, add to master list
             achievement_pile = Pile((self.player_names[i] + " achievement pile"), self.seed)
@@ -1032,6 +2153,8 @@ class InnovationGame(Game):
 
             player = InnovationPlayer(self.player_names[i], i, self.ai_players[i], achievement_pile, score_pile, hand,
                                       b_stack, g_stack, p_stack, r_stack, y_stack, action_function, option_function)
+            if self.ai_players[i]:
+                player.select_an_action_number = self.ai_action_number_functions[i]
             self.add_player(player)
 
         for player in self.players:
@@ -1129,19 +2252,25 @@ class InnovationGame(Game):
 
         for player in self.ordered_players:
             self.turn_player = player
-            self.print_for_testing("---\nRound {r} - {n}'s Turn".format(r=self.round, n=player.name))
+            self.actions_left_in_turn = self.get_number_of_actions_in_turn(player)
+            if self.game_log.turn:
+                self.game_log.event('turn', "---\nRound {r} - {n}'s Turn", r=self.round, n=player.name)
 
             if self.number_of_players < 4 and player.table_position == 0:
-                self.print_for_testing("{n}'s first action:".format(n=player.name))
+                if self.game_log.turn:
+                    self.game_log.event('turn', "{n}'s first action:", n=player.name)
                 self.take_action()
             elif self.number_of_players == 4 and (player.table_position == 0 or player.table_position == 1):
-                self.print_for_testing("{n}'s first action:".format(n=player.name))
+                if self.game_log.turn:
+                    self.game_log.event('turn', "{n}'s first action:", n=player.name)
                 self.take_action()
             else:
-                self.print_for_testing("{n}'s first action:".format(n=player.name))
+                if self.game_log.turn:
+                    self.game_log.event('turn', "{n}'s first action:", n=player.name)
                 self.take_action()
 
-                self.print_for_testing("\n{n}'s second action:".format(n=player.name))
+                if self.game_log.turn:
+                    self.game_log.event('turn', "\n{n}'s second action:", n=player.name)
                 self.take_action()
 
     def play_round(self):
@@ -1149,13 +2278,16 @@ class InnovationGame(Game):
         self.round += 1
         for player in self.ordered_players:
             self.turn_player = player
+            self.actions_left_in_turn = 2
             if not self.game_over:
-                self.print_for_testing("---\nRound {r} - {n}'s Turn\n{n}'s first action:".format(r=self.round,
-                                                                                                 n=player.name))
+                if self.game_log.turn:
+                    self.game_log.event('turn', "---\nRound {r} - {n}'s Turn\n{n}'s first action:", r=self.round,
+                                        n=player.name)
                 self.take_action()
 
             if not self.game_over:
-                self.print_for_testing("\n{n}'s second action:".format(n=player.name))
+                if self.game_log.turn:
+                    self.game_log.event('turn', "\n{n}'s second action:", n=player.name)
                 self.take_action()
 
     def play_game(self):
@@ -1167,6 +2299,31 @@ class InnovationGame(Game):
         while not self.game_over:
             self.play_round()
 
+    def get_number_of_actions_in_turn(self, player):
+        """In the first round the first player (first two players with four players) only gets one action"""
+        if self.round == 1 and (player.table_position == 0 or
+                                (self.number_of_players == 4 and player.table_position == 1)):
+            return 1
+        return 2
+
+    def play_rest_of_game(self):
+        """Plays on from the middle of a turn after the starting melds, as play_game would have, without logging the
+        turn headers. Used to play out a copy of a game from a decision."""
+        while self.actions_left_in_turn > 0 and not self.game_over:
+            self.take_action()
+
+        # Rest of the round
+        for player in self.ordered_players[self.ordered_players.index(self.turn_player) + 1:]:
+            if self.game_over:
+                break
+            self.turn_player = player
+            self.actions_left_in_turn = self.get_number_of_actions_in_turn(player)
+            while self.actions_left_in_turn > 0 and not self.game_over:
+                self.take_action()
+
+        while not self.game_over:
+            self.play_round()
+
     # UI functions
     def print_card_locations(self):
         for pile in self.piles:
@@ -1176,20 +2333,28 @@ class InnovationGame(Game):
 
     # Game end functions
     def game_end(self):
-        self.game_over = True
-        self.print_for_testing('Game over')
+        self.set_journaled(self, 'game_over', True)
+        self.close_worker_pool()
+        if self.game_log.result:
+            self.game_log.event('result', 'Game over')
         self.print_final_scores()
         if self.winning_player:
-            self.print_for_testing("Winner - {n}".format(n=self.winning_player.name))
+            if self.game_log.result:
+                self.game_log.event('result', "Winner - {n}", n=self.winning_player.name)
         else:
-            self.print_for_testing('Game ends in draw')
+            if self.game_log.result:
+                self.game_log.event('result', 'Game ends in draw')
+
+    def set_winner(self, player):
+        self.set_journaled(player, 'winner', True)
+        self.set_journaled(self, 'winning_player', player)
 
     def check_game_end_ai(self):
         top_cards = self.get_all_top_cards()
         if (self.get_card_object('Robotics') in top_cards) and (self.get_card_object('Software') in top_cards):
             lowest_players = self.get_players_with_lowest_score()
             if len(lowest_players) == 1:
-                lowest_players[0].winner = True
+                self.set_winner(lowest_players[0])
                 self.game_end()
 
     def check_game_end_globalization(self):
@@ -1203,30 +2368,28 @@ class InnovationGame(Game):
     def check_game_end_achievements(self):
         """Runs when a card is added to an achievement pile. Checks to see if anybody has met goal."""
         for player in self.players:
-            self.print_for_testing('{p} has {a} achievements'.format(p=player.name,
-                                                                     a=player.achievement_pile.get_pile_size()))
+            if self.game_log.result:
+                self.game_log.event('result', '{p} has {a} achievements', p=player.name,
+                                    a=player.achievement_pile.get_pile_size())
             if player.achievement_pile.get_pile_size() >= self.achievement_goal:
-                player.winner = True
+                self.set_winner(player)
                 self.game_end()
 
     def check_single_player_highest_score(self):
         highest_score_players = self.get_players_with_highest_score()
         if len(highest_score_players) == 1:
-            highest_score_players[0].winner = True
-            self.winning_player = highest_score_players[0]
+            self.set_winner(highest_score_players[0])
             self.game_end()
 
     def game_end_score(self):
         highest_score_players = self.get_players_with_highest_score()
 
         if len(highest_score_players) == 1:
-            highest_score_players[0].winner = True
-            self.winning_player = highest_score_players[0]
+            self.set_winner(highest_score_players[0])
         else:
             players_with_most_achievements = self.get_players_with_most_achievements(highest_score_players)
             if len(players_with_most_achievements) == 1:
-                players_with_most_achievements[0].winner = True
-                self.winning_player = players_with_most_achievements[0]
+                self.set_winner(players_with_most_achievements[0])
             else:
                 # TODO - Do I need to do anything special if there is a draw?
                 pass
@@ -1234,12 +2397,11 @@ class InnovationGame(Game):
         self.game_end()
 
     def print_final_scores(self):
-        if self.verbose:
-            print('---Final Scores---')
+        if self.game_log.result:
+            self.game_log.event('result', '---Final Scores---')
             for player in self.players:
-                print(player.name)
-                print("Score:        {s}".format(s=player.get_score()))
-                print("Achievements: {a}\n".format(a=player.achievement_pile.get_pile_size()))
+                self.game_log.event('result', "{p}\nScore:        {s}\nAchievements: {a}\n", p=player.name,
+                                    s=player.get_score(), a=player.achievement_pile.get_pile_size())
 
     def get_players_with_lowest_score(self):
         scores = []
@@ -1282,41 +2444,52 @@ class InnovationGame(Game):
 
     # Save game state
     def get_pile_state(self):
+        if self.testing:
+            self.check_for_duplicate_cards()
+
         pile_state = {}
-        check_added_cards = []
         for pile in self.piles:
-            card_list = []
+            pile_state.update({pile.name: [card.name for card in pile.cards]})
+
+        return pile_state
+
+    def check_for_duplicate_cards(self):
+        """Raises an error if any card is in more than one pile, or in the same pile twice. Run automatically when
+        testing."""
+        check_added_cards = set()
+        for pile in self.piles:
             for card in pile.cards:
                 if card in check_added_cards:
                     raise ValueError("Duplicate card. Card {c} is already in pile {p}".format(c=card.name, p=pile.name))
-                card_list.append(card.name)
-                check_added_cards.append(card)
-            pile_state.update({pile.name: card_list})
-
-        return pile_state
+                check_added_cards.add(card)
 
-    def update_pile_state_history(self, pile_state):
-        self.pile_state_history.append(pile_state)
+    def update_pile_state_history(self, label):
+        """Marks the current point in the pile state history, returns the event number to rebuild it from"""
+        return self.pile_state_history.add_mark(label)
 
+    # Full copies of the piles are only taken while testing, as the tests compare against them. Otherwise the state
+    # at these points can be rebuilt from the pile state history using the history marks.
     def set_action_pile_state(self):
-        current_state = self.get_pile_state()
-        self.piles_at_beginning_of_action = current_state
-        self.update_pile_state_history(current_state)
+        if self.testing:
+            self.piles_at_beginning_of_action = self.get_pile_state()
+        self.history_mark_at_beginning_of_action = self.update_pile_state_history('action')
 
     def set_effect_pile_state(self):
-        current_state = self.get_pile_state()
-        self.piles_at_beginning_of_effect = current_state
-        self.update_pile_state_history(current_state)
+        if self.testing:
+            self.piles_at_beginning_of_effect = self.get_pile_state()
+        self.state_version_at_beginning_of_effect = self.state_version
+        self.history_mark_at_beginning_of_effect = self.update_pile_state_history('effect')
 
     def set_no_share_pile_state(self):
-        current_state = self.get_pile_state()
-        self.piles_at_beginning_of_no_share = current_state
-        self.update_pile_state_history(current_state)
+        if self.testing:
+            self.piles_at_beginning_of_no_share = self.get_pile_state()
+        self.history_mark_at_beginning_of_no_share = self.update_pile_state_history('no share')
 
     def set_card_location_from_dictionary(self, card_dict):
         for card_info, pile_info in card_dict.items():
-            self.get_card_object(card_info).current_pile = self.get_pile_object(pile_info[0])
-            self.get_card_object(card_info).current_position = int(pile_info[1])
+            card = self.get_card_object(card_info)
+            card.current_position = int(pile_info[1])
+            self.move_card_to_pile(card, self.get_pile_object(pile_info[0]))
 
     def return_cards_to_piles(self):
         for card in self.cards:
@@ -1324,7 +2497,317 @@ class InnovationGame(Game):
 
     def sort_cards_in_piles(self):
         for pile in self.piles:
-            pile.cards = sorted(pile.cards, key=lambda x: x.current_position)
+            pile.cards = deque(sorted(pile.cards, key=lambda x: x.current_position))
+            if isinstance(pile, InnovationStack):
+                pile.rebuild_icon_totals()
+
+    # Saving and loading states
+    def get_state_struct(self):
+        """Returns the fixed byte layout of a saved state for this game, building it on first use.
+
+        Header: format version, number of players, round, turn player, game over, winning player, action count,
+        actions left in the turn.
+        Then the table position and winner flag of each player, the splay of each stack, and for each card the
+        number of the pile it is in and its position from the top of that pile. 255 stands for no player, or for a
+        card that is not in any pile."""
+        if self.state_struct is None:
+            if len(self.piles) > 255 or len(self.cards) > 255:
+                raise ValueError("Could not save game " + str(self.name) + ". Too many piles or cards for the layout.")
+            body_size = 2 * len(self.players) + len(self.stacks) + 2 * len(self.cards)
+            self.state_struct = struct.Struct(self.state_header_format + str(body_size) + 'B')
+        return self.state_struct
+
+    def get_state_encoder(self):
+        """Returns the StateEncoder of this game, built on first use"""
+        if self.state_encoder is None:
+            self.state_encoder = StateEncoder(self)
+        return self.state_encoder
+
+    def set_trajectory_recording(self, directory=None, prefix='trajectories', shard_size=65536):
+        """Records every decision of the games played into shards in the directory, see TrajectoryRecorder. Without a
+        directory, stops recording and writes the last shard."""
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.close()
+            self.trajectory_recorder = None
+        if directory is not None:
+            self.trajectory_recorder = TrajectoryRecorder(self, directory, prefix, shard_size)
+            self.trajectory_recorder.enable()
+
+    def save_state(self):
+        """Returns the state of the game as bytes in the layout from get_state_struct"""
+        state_struct = self.get_state_struct()
+        values = [self.state_format_version,
+                  len(self.players),
+                  self.round,
+                  self.turn_player.number if self.turn_player else 255,
+                  self.game_over,
+                  self.winning_player.number if self.winning_player else 255,
+                  self.action_count,
+                  self.actions_left_in_turn]
+        for player in self.players:
+            values.append(player.table_position)
+            values.append(player.winner)
+        for stack in self.stacks:
+            values.append(stack.splay)
+
+        card_locations = [255] * (2 * len(self.cards))
+        card_numbers = self.card_numbers
+        for pile_number, pile in enumerate(self.piles):
+            position = 0
+            for card in pile.cards:
+                index = 2 * card_numbers[card.name]
+                card_locations[index] = pile_number
+                card_locations[index + 1] = position
+                position += 1
+
+        return state_struct.pack(*values, *card_locations)
+
+    def load_state(self, state):
+        """Puts the game into a state returned by save_state"""
+        state_struct = self.get_state_struct()
+        if len(state) != state_struct.size:
+            raise ValueError("Could not load state. Expected " + str(state_struct.size) + " bytes, got " +
+                             str(len(state)) + ".")
+        values = state_struct.unpack(state)
+        version, number_of_players, self.round, turn_player_number, game_over, winning_player_number, \
+            self.action_count, self.actions_left_in_turn = values[:8]
+        if version != self.state_format_version or number_of_players != len(self.players):
+            raise ValueError("Could not load state. It was saved in another format or for another number of players.")
+
+        self.game_over = bool(game_over)
+        self.turn_player = self.get_player_object(turn_player_number)
+        self.active_player = self.turn_player
+        self.winning_player = self.get_player_object(winning_player_number)
+
+        index = 8
+        for player in self.players:
+            player.table_position = values[index]
+            player.winner = bool(values[index + 1])
+            index += 2
+        # Table positions are only set once the starting melds are done, and then the turn order follows them
+        if any(player.table_position for player in self.players):
+            self.ordered_players = sorted(self.players, key=lambda x: x.table_position)
+        else:
+            self.ordered_players = []
+        splays = values[index:index + len(self.stacks)]
+        index += len(self.stacks)
+
+        # Put every card back in its pile, in order from the top
+        pile_contents = [[] for _ in self.piles]
+        for card in self.cards:
+            pile_number = values[index]
+            if pile_number == 255:
+                card.current_pile = None
+            else:
+                pile_contents[pile_number].append((values[index + 1], card))
+            index += 2
+        for pile, contents in zip(self.piles, pile_contents):
+            contents.sort(key=lambda x: x[0])
+            pile.cards.clear()
+            for position, card in contents:
+                pile.cards.append(card)
+                card.current_pile = pile
+
+        for stack, splay in zip(self.stacks, splays):
+            stack.splay = splay
+            stack.rebuild_icon_totals()
+
+        self.stop_journal()
+        self.state_version += 1
+        self.set_pile_state_history_retention(self.pile_state_history.retention, self.pile_state_history.ring_size)
+
+    # Undo journal
+    def get_turn_state(self):
+        # Searches change the nodes of the kept search trees in place, so the trees are saved as pickled bytes
+        search_trees = pickle.dumps(self.search_trees) if self.search_trees else None
+        return (self.round, self.action_count, self.actions_left_in_turn, self.turn_player, self.active_player,
+                self.effect_player, self.turn_card, self.active_card, list(self.ordered_players),
+                [player.table_position for player in self.players], search_trees)
+
+    def set_turn_state(self, turn_state):
+        self.round, self.action_count, self.actions_left_in_turn, self.turn_player, self.active_player, \
+            self.effect_player, self.turn_card, self.active_card, self.ordered_players, table_positions, \
+            search_trees = turn_state
+        self.ordered_players = list(self.ordered_players)
+        for player, table_position in zip(self.players, table_positions):
+            player.table_position = table_position
+        self.search_trees = pickle.loads(search_trees) if search_trees is not None else {}
+
+    # Hidden information
+    def get_hidden_piles(self, player):
+        """Piles whose cards the player cannot see, only how many there are of each age: the draw piles and the other
+        players' hands and score piles. The achievements are cards of their own that only have an age."""
+        hidden_piles = list(self.draw_piles)
+        for other_player in self.players:
+            if other_player is not player:
+                hidden_piles.append(other_player.hand)
+                hidden_piles.append(other_player.score_pile)
+        return hidden_piles
+
+    def determinize(self, player, random_stream):
+        """Deals the cards the player cannot see out again at random, each to the place of a hidden card of the same
+        age, so the game is one the player cannot tell from the real one. Used on a copy of the game before looking
+        ahead, so AIs do not use what they cannot know."""
+        hidden_piles = self.get_hidden_piles(player)
+        cards_by_age = {}
+        for pile in hidden_piles:
+            for card in pile.cards:
+                cards_by_age.setdefault(card.age, []).append(card)
+        for cards in cards_by_age.values():
+            random_stream.shuffle(cards)
+
+        for pile in hidden_piles:
+            pile.replace_cards([cards_by_age[card.age].pop() for card in pile.cards])
+
+    def get_information_state(self, player):
+        """State of the game as the player sees it, the same in every game determinize can deal from this one: the
+        hidden piles only by the ages of their cards, every other pile by its cards in order"""
+        hidden_piles = self.get_hidden_piles(player)
+        piles = []
+        for pile in self.piles:
+            if pile in hidden_piles:
+                piles.append(tuple(sorted(card.age for card in pile.cards)))
+            else:
+                piles.append(tuple(card.name for card in pile.cards))
+        return (player.number, self.round, self.turn_player.number if self.turn_player else None, self.action_count,
+                tuple(stack.splay for stack in self.stacks), tuple(piles))
+
+    def __getstate__(self):
+        """Pickles the game without the byte layout and the process pool, which are built again when needed"""
+        state = self.__dict__.copy()
+        state['state_struct'] = None
+        state['trajectory_recorder'] = None
+        state['worker_pool'] = None
+        state['worker_pool_size'] = 0
+        return state
+
+    # Cloning
+    def clone(self):
+        """Returns a copy of the game, random streams included, that plays on the same way without changing this one.
+        Clone between actions; options offered during an effect are not copied."""
+        clone = self.copy_shell(self)
+
+        # Anything replaced on this game object, such as profiler or benchmark timers, is left behind
+        for name, value in list(clone.__dict__.items()):
+            if isinstance(value, types.FunctionType):
+                del clone.__dict__[name]
+
+        cards = {}
+        for card in self.cards:
+            cards[card] = self.copy_shell(card)
+
+        effects = {}
+        for effect in self.effects:
+            new_effect = self.copy_shell(effect)
+            new_effect.__dict__.pop('activate', None)
+            new_effect.function = self.rebind_function(clone, effect.function)
+            effects[effect] = new_effect
+        for card, new_card in cards.items():
+            if isinstance(card, InnovationCard):
+                new_card.dogma = [effects[effect] for effect in card.dogma]
+
+        piles = {}
+        for pile in self.piles:
+            new_pile = self.copy_shell(pile)
+            new_pile.__dict__.pop('state_changed', None)
+            new_pile.game = clone
+            if pile.random is not None:
+                new_pile.random = self.copy_random(pile.random)
+            new_pile.cards = deque([cards[card] for card in pile.cards])
+            for card in new_pile.cards:
+                card.current_pile = new_pile
+            if isinstance(pile, InnovationStack):
+                new_pile.icon_totals = list(pile.icon_totals)
+                new_pile.splayed_icon_sums = [list(sums) for sums in pile.splayed_icon_sums]
+            piles[pile] = new_pile
+
+        players = {}
+        for player in self.players:
+            new_player = self.copy_shell(player)
+            new_player.random = self.copy_random(player.random)
+            new_player.achievement_pile = piles[player.achievement_pile]
+            new_player.score_pile = piles[player.score_pile]
+            new_player.hand = piles[player.hand]
+            new_player.blue_stack = piles[player.blue_stack]
+            new_player.green_stack = piles[player.green_stack]
+            new_player.purple_stack = piles[player.purple_stack]
+            new_player.red_stack = piles[player.red_stack]
+            new_player.yellow_stack = piles[player.yellow_stack]
+            new_player.stacks = [piles[stack] for stack in player.stacks]
+            for stack in new_player.stacks:
+                stack.owner = new_player
+            new_player.icon_totals = list(player.icon_totals)
+            new_player.action_options = []
+            new_player.selected_action = None
+            new_player.options = []
+            new_player.selected_option_log = []
+            new_player.selected_option = None
+            new_player.select_an_action = self.rebind_function(clone, player.select_an_action)
+            new_player.select_an_option = self.rebind_function(clone, player.select_an_option)
+            new_player.select_an_action_number = self.rebind_function(clone, player.select_an_action_number)
+            players[player] = new_player
+        for new_player in players.values():
+            new_player.share_order = [players[player] for player in new_player.share_order]
+        players[None] = None
+        cards[None] = None
+
+        clone.cards = [cards[card] for card in self.cards]
+        clone.card_index = {card.name: card for card in clone.cards}
+        clone.effects = [effects[effect] for effect in self.effects]
+        clone.effect_index = {effect.name: effect for effect in clone.effects}
+        clone.piles = [piles[pile] for pile in self.piles]
+        clone.pile_index = {pile.name: pile for pile in clone.piles}
+        clone.draw_piles = [piles[pile] for pile in self.draw_piles]
+        clone.stacks = [piles[stack] for stack in self.stacks]
+        clone.starting_piles = [(piles[pile], [cards[card] for card in starting_cards])
+                                for pile, starting_cards in self.starting_piles]
+        clone.players = [players[player] for player in self.players]
+        clone.player_index = {player.number: player for player in clone.players}
+        clone.ordered_players = [players[player] for player in self.ordered_players]
+        clone.active_player = players[self.active_player]
+        clone.turn_player = players[self.turn_player]
+        clone.effect_player = players[self.effect_player]
+        clone.winning_player = players[self.winning_player]
+        clone.active_card = cards[self.active_card]
+        clone.turn_card = cards[self.turn_card]
+        clone.ai_action_functions = [self.rebind_function(clone, function) for function in self.ai_action_functions]
+        clone.ai_option_functions = [self.rebind_function(clone, function) for function in self.ai_option_functions]
+        clone.ai_action_number_functions = [self.rebind_function(clone, function)
+                                            for function in self.ai_action_number_functions]
+
+        clone.game_log = GameLog(self.game_log.active, self.game_log.level)
+        clone.game_log.disabled_categories = set(self.game_log.disabled_categories)
+        clone.game_log.update_flags()
+        clone.effect_profiler = None
+        clone.trajectory_recorder = None
+        clone.worker_pool = None
+        clone.worker_pool_size = 0
+        clone.search_trees = {}
+        clone.search_children = None
+        clone.search_path = []
+        clone.stop_journal()
+        clone.pile_state_history = PileStateHistory(clone, self.pile_state_history.retention,
+                                                    self.pile_state_history.ring_size)
+        clone.pile_state_history.take_keyframe()
+        return clone
+
+    def copy_shell(self, original):
+        """Returns a new object of the same class with the same attributes, without calling __init__"""
+        new_object = original.__class__.__new__(original.__class__)
+        new_object.__dict__.update(original.__dict__)
+        return new_object
+
+    def rebind_function(self, clone, function):
+        """Returns the clone's version of a function bound to this game, or the function itself if it is not"""
+        if getattr(function, '__self__', None) is self:
+            return getattr(clone, function.__name__)
+        return function
+
+    def copy_random(self, random_stream):
+        """Returns a new random stream that continues from the same point as random_stream"""
+        new_random_stream = random.Random.__new__(random.Random)
+        new_random_stream.setstate(random_stream.getstate())
+        return new_random_stream
 
     # Base functions
     def base_draw(self, draw_value):
@@ -1365,21 +2848,17 @@ class InnovationGame(Game):
 
     def find_and_remove_card(self, card):
         """Finds pile where card is located and removes it from that pile"""
-        for pile in self.piles:
-            for c in pile.cards:
-                if c == card:
-                    pile.remove_card(c)
+        if card.current_pile is not None:
+            card.current_pile.remove_card(card)
 
     def find_card(self, card):
-        for pile in self.piles:
-            for c in pile.cards:
-                if c == card:
-                    return pile
+        return card.current_pile
 
     def move_card_to_pile(self, card, pile):
         self.find_and_remove_card(card)
         pile.add_card_to_bottom(card)
-        self.print_for_testing("{a} moves {c} to {p}".format(a=self.active_player.name, c=card.name, p=pile.name))
+        if self.game_log.card:
+            self.game_log.event('card', "{a} moves {c} to {p}", a=self.active_player.name, c=card.name, p=pile.name)
 
     def move_multiple_cards_to_pile(self, card_list, destination_pile):
         cards = list(card_list)
@@ -1393,7 +2872,8 @@ class InnovationGame(Game):
     def reveal_card(self, card):
         if not self.game_over:
             # TODO - update to inform card counting module, remove printing
-            self.print_for_testing('{p} reveals {c}'.format(p=self.active_player, c=card.name))
+            if self.game_log.card:
+                self.game_log.event('card', '{p} reveals {c}', p=self.active_player, c=card.name)
 
     # Combination functions used as card actions
     def add_card_to_achievement_pile(self):
@@ -1401,7 +2881,9 @@ class InnovationGame(Game):
         if not self.game_over:
             self.find_and_remove_card(self.active_card)
             self.active_player.achievement_pile.add_card_to_bottom(self.active_card)
-            self.print_for_testing('{p} claims achievement: {c}'.format(p=self.active_player, c=self.active_card.name))
+            if self.game_log.card:
+                self.game_log.event('card', '{p} claims achievement: {c}', p=self.active_player,
+                                    c=self.active_card.name)
             self.check_game_end_achievements()
 
     def claim_special_achievement(self, achievement_name):
@@ -1410,30 +2892,36 @@ class InnovationGame(Game):
             if card in self.get_pile_object('special achievements').cards:
                 self.find_and_remove_card(card)
                 self.active_player.achievement_pile.add_card_to_bottom(card)
-                self.print_for_testing('{p} claims special achievement: {c}'.format(p=self.active_player, c=card.name))
+                if self.game_log.card:
+                    self.game_log.event('card', '{p} claims special achievement: {c}', p=self.active_player,
+                                        c=card.name)
                 self.check_game_end_achievements()
             else:
-                self.print_for_testing('Special achievement {c} already claimed'.format(c=card.name))
+                if self.game_log.card:
+                    self.game_log.event('card', 'Special achievement {c} already claimed', c=card.name)
 
     def add_card_to_hand(self):
         """Moves selected card to active player's hand"""
         if not self.game_over:
             self.find_and_remove_card(self.active_card)
             self.active_player.hand.add_card_to_bottom(self.active_card)
-            self.print_for_testing('{p} adds {c} to hand'.format(p=self.active_player, c=self.active_card.name))
+            if self.game_log.card:
+                self.game_log.event('card', '{p} adds {c} to hand', p=self.active_player, c=self.active_card.name)
 
     def add_card_to_score_pile(self):
         """Moves selected card to the score pile"""
         if not self.game_over:
             self.find_and_remove_card(self.active_card)
             self.base_score(self.active_card)
-            self.print_for_testing('{p} adds {c} to score pile'.format(p=self.active_player, c=self.active_card.name))
+            if self.game_log.card:
+                self.game_log.event('card', '{p} adds {c} to score pile', p=self.active_player, c=self.active_card.name)
 
     def demand_transfer_card_from_board_to_score_pile(self):
         self.find_and_remove_card(self.active_card)
         self.active_player = self.turn_player
         self.base_score(self.active_card)
-        self.print_for_testing('{p} adds {c} to score pile'.format(p=self.active_player, c=self.active_card.name))
+        if self.game_log.card:
+            self.game_log.event('card', '{p} adds {c} to score pile', p=self.active_player, c=self.active_card.name)
         self.active_player = self.effect_player
 
     def demand_transfer_multiple_cards_from_board_to_score_pile(self, list_of_cards):
@@ -1445,7 +2933,8 @@ class InnovationGame(Game):
         """Draws a card to a players hand of a specified draw value"""
         self.base_draw(draw_value)
         if not self.game_over:
-            self.print_for_testing('{p} draws {c}'.format(p=self.active_player, c=self.active_card.name))
+            if self.game_log.card:
+                self.game_log.event('card', '{p} draws {c}', p=self.active_player, c=self.active_card.name)
             self.add_card_to_hand()
 
     def draw_to_hand_multiple(self, draw_value, number_of_cards):
@@ -1458,7 +2947,8 @@ class InnovationGame(Game):
         if not self.game_over:
             self.find_and_remove_card(self.active_card)
             self.base_meld(self.active_card)
-            self.print_for_testing('{p} draws and melds {c}'.format(p=self.active_player, c=self.active_card.name))
+            if self.game_log.card:
+                self.game_log.event('card', '{p} draws and melds {c}', p=self.active_player, c=self.active_card.name)
 
     def draw_and_meld_multiple(self, draw_value, number_of_cards):
         for i in range(number_of_cards):
@@ -1469,12 +2959,15 @@ class InnovationGame(Game):
         self.base_draw(draw_value)
         if not self.game_over:
             # TODO - update to inform card counting module, remove printing
-            self.print_for_testing('{p} draws and reveals {c}'.format(p=self.active_player, c=self.active_card.name))
+            if self.game_log.card:
+                self.game_log.event('card', '{p} draws and reveals {c}', p=self.active_player, c=self.active_card.name)
 
     def draw_and_score(self, draw_value):
         self.base_draw(draw_value)
         if not self.game_over:
-            self.print_for_testing('{p} draws and scores an age {c} card'.format(p=self.active_player, c=self.active_card.age))
+            if self.game_log.card:
+                self.game_log.event('card', '{p} draws and scores an age {c} card', p=self.active_player,
+                                    c=self.active_card.age)
             self.add_card_to_score_pile()
 
     def draw_and_tuck(self, draw_value):
@@ -1483,7 +2976,8 @@ class InnovationGame(Game):
             self.find_and_remove_card(self.active_card)
             self.base_tuck(self.active_card)
             # TODO - update to inform card counting module
-            self.print_for_testing('{p} draws and tucks {c}'.format(p=self.active_player, c=self.active_card.name))
+            if self.game_log.card:
+                self.game_log.event('card', '{p} draws and tucks {c}', p=self.active_player, c=self.active_card.name)
 
     def draw_and_tuck_multiple(self, draw_value, number_of_cards):
         for i in range(number_of_cards):
@@ -1493,7 +2987,8 @@ class InnovationGame(Game):
     def return_card(self):
         self.find_and_remove_card(self.active_card)
         self.base_return(self.active_card)
-        self.print_for_testing('{p} returns {c}'.format(p=self.active_player.name, c=self.active_card.name))
+        if self.game_log.card:
+            self.game_log.event('card', '{p} returns {c}', p=self.active_player.name, c=self.active_card.name)
 
     def score_cards(self, card_list):
         cards_to_score = list(card_list)
@@ -1501,19 +2996,22 @@ class InnovationGame(Game):
             if not self.game_over:
                 self.find_and_remove_card(card)
                 self.base_score(card)
-                self.print_for_testing('{p} scores {c}'.format(p=self.active_player.name, c=card.name))
+                if self.game_log.card:
+                    self.game_log.event('card', '{p} scores {c}', p=self.active_player.name, c=card.name)
 
     def meld_card(self):
         if not self.game_over:
             self.find_and_remove_card(self.active_card)
             self.base_meld(self.active_card)
-            self.print_for_testing('{p} melds {c}'.format(p=self.active_player.name, c=self.active_card.name))
+            if self.game_log.card:
+                self.game_log.event('card', '{p} melds {c}', p=self.active_player.name, c=self.active_card.name)
 
     def tuck_card(self):
         if not self.game_over:
             self.find_and_remove_card(self.active_card)
             self.base_tuck(self.active_card)
-            self.print_for_testing('{p} tucks {c}'.format(p=self.active_player.name, c=self.active_card.name))
+            if self.game_log.card:
+                self.game_log.event('card', '{p} tucks {c}', p=self.active_player.name, c=self.active_card.name)
 
     # Actions
     def action_draw(self):
@@ -1560,9 +3058,9 @@ class InnovationGame(Game):
                             self.set_effect_pile_state()
                             self.active_player = eligible_player
                             self.effect_player = eligible_player
-                            self.print_for_testing('{t} DEMANDS {p} resolve {c} dogma'.format(t=self.turn_player,
-                                                                                              p=eligible_player.name,
-                                                                                              c=self.turn_card.name))
+                            if self.game_log.effect:
+                                self.game_log.event('effect', '{t} DEMANDS {p} resolve {c} dogma', t=self.turn_player,
+                                                    p=eligible_player.name, c=self.turn_card.name)
                             effect.activate()
 
             else:
@@ -1572,7 +3070,9 @@ class InnovationGame(Game):
                         self.set_effect_pile_state()
                         self.active_player = eligible_player
                         self.effect_player = eligible_player
-                        self.print_for_testing('{p} resolves {c} dogma'.format(p=eligible_player.name, c=self.turn_card.name))
+                        if self.game_log.effect:
+                            self.game_log.event('effect', '{p} resolves {c} dogma', p=eligible_player.name,
+                                                c=self.turn_card.name)
                         effect.activate()
 
                         # Only run sharing code if it's not the turn player and nobody has shared yet.
@@ -1580,14 +3080,18 @@ class InnovationGame(Game):
                             dogma_was_shared = self.check_if_opponent_shared()
 
         if not self.game_over and dogma_was_shared:
-            self.print_for_testing('{p} draws a card due to other players sharing effect'.format(p=self.turn_player))
+            if self.game_log.effect:
+                self.game_log.event('effect', '{p} draws a card due to other players sharing effect',
+                                    p=self.turn_player)
             self.action_draw()
 
     def execute_dogma_for_yourself(self):
         self.set_no_share_pile_state()
         for effect in self.active_card.dogma:
             if not effect.demand and not self.game_over:
-                self.print_for_testing('{p} resolves {c} dogma'.format(p=self.active_player.name, c=self.active_card.name))
+                if self.game_log.effect:
+                    self.game_log.event('effect', '{p} resolves {c} dogma', p=self.active_player.name,
+                                        c=self.active_card.name)
                 effect.activate()
 
     def determine_who_can_share(self):
@@ -1602,12 +3106,7 @@ class InnovationGame(Game):
         return sharing_players
 
     def check_if_opponent_shared(self):
-        original_state = self.piles_at_beginning_of_effect
-        current_state = self.get_pile_state()
-        if original_state != current_state:
-            return True
-        else:
-            return False
+        return self.state_version != self.state_version_at_beginning_of_effect
 
     def draw_if_opponents_shared(self, list_of_players):
         non_demand_effects = False
@@ -1616,19 +3115,37 @@ class InnovationGame(Game):
                 non_demand_effects = True
         if len(list_of_players) > 1 and non_demand_effects:
             # TODO - update this to make sure something in the game state changes
-            self.print_for_testing('{p} draws a card due to other players sharing effect'.format(p=self.turn_player))
+            if self.game_log.effect:
+                self.game_log.event('effect', '{p} draws a card due to other players sharing effect',
+                                    p=self.turn_player)
             self.action_draw()
 
     # Functions to select and simulate actions
     def take_action(self):
         """Function to take an action"""
         if not self.game_over:
+            self.action_count += 1
+            self.actions_left_in_turn -= 1
             self.set_action_pile_state()
             self.set_effect_pile_state()
             self.active_player = self.turn_player
-            self.available_actions()
-            self.select_action()
-            self.execute_action()
+            if self.turn_player.select_an_action_number:
+                legal_action_numbers = self.get_legal_action_numbers()
+                self.execute_action_number(self.turn_player.select_an_action_number(legal_action_numbers))
+            else:
+                self.available_actions()
+                self.select_action()
+                self.execute_action()
+
+    def take_action_number(self, action_number):
+        """Takes the action with this number for the turn player, instead of asking them to select one"""
+        if not self.game_over:
+            self.action_count += 1
+            self.actions_left_in_turn -= 1
+            self.set_action_pile_state()
+            self.set_effect_pile_state()
+            self.active_player = self.turn_player
+            self.execute_action_number(action_number)
 
     def available_actions(self):
         draw_action = Action('draw', self.turn_player, None)
@@ -1657,7 +3174,9 @@ class InnovationGame(Game):
 
     def select_action(self):
         self.turn_player.select_an_action()
-        self.print_for_testing("{p} chooses {s}".format(p=self.turn_player.name, s=self.turn_player.selected_action.name))
+        if self.game_log.action:
+            self.game_log.event('action', "{p} chooses {s}", p=self.turn_player.name,
+                                s=self.turn_player.selected_action.name)
 
     def execute_action(self):
         action = self.turn_player.selected_action
@@ -1674,6 +3193,117 @@ class InnovationGame(Game):
         elif action.type == 'dogma':
             self.action_dogma()
 
+    # Action and option numbers
+    def set_action_space(self):
+        """Numbers every card, and sets the size of the action and option spaces from the number of cards"""
+        self.card_numbers = {card.name: number for number, card in enumerate(self.cards)}
+        self.action_achieve_offset = 1
+        self.action_meld_offset = self.action_achieve_offset + 10
+        self.action_dogma_offset = self.action_meld_offset + len(self.cards)
+        self.action_space_size = self.action_dogma_offset + len(self.colors)
+        # An option list never holds more than one option for each card, plus pass
+        self.option_space_size = len(self.cards) + 1
+        # Size of a mask that fits either kind of decision
+        self.decision_space_size = max(self.action_space_size, self.option_space_size)
+
+    def get_legal_action_numbers(self):
+        """Returns the number of every action the turn player can take, in the same order as available_actions"""
+        player = self.turn_player
+        action_numbers = [0]
+        for achievement in self.eligible_achievements(player):
+            action_numbers.append(self.action_achieve_offset + achievement.age - 1)
+        card_numbers = self.card_numbers
+        for card in player.hand.cards:
+            action_numbers.append(self.action_meld_offset + card_numbers[card.name])
+        color = 0
+        for stack in player.stacks:
+            if stack.cards:
+                action_numbers.append(self.action_dogma_offset + color)
+            color += 1
+        return action_numbers
+
+    def get_action_mask(self, legal_action_numbers=None):
+        """Returns a bytearray over the whole action space, 1 for every legal action"""
+        if legal_action_numbers is None:
+            legal_action_numbers = self.get_legal_action_numbers()
+        mask = bytearray(self.action_space_size)
+        for action_number in legal_action_numbers:
+            mask[action_number] = 1
+        return mask
+
+    def get_action_card(self, action_number):
+        """Returns the card an action number is for, None for draw. Raises ValueError if the turn player cannot take
+        the action."""
+        player = self.turn_player
+        card = None
+        if action_number == 0:
+            return card
+        elif self.action_achieve_offset <= action_number < self.action_meld_offset:
+            age = action_number - self.action_achieve_offset + 1
+            for achievement in self.eligible_achievements(player):
+                if achievement.age == age:
+                    card = achievement
+        elif self.action_meld_offset <= action_number < self.action_dogma_offset:
+            card = self.cards[action_number - self.action_meld_offset]
+            if card.current_pile is not player.hand:
+                card = None
+        elif self.action_dogma_offset <= action_number < self.action_space_size:
+            card = player.stacks[action_number - self.action_dogma_offset].see_top_card()
+
+        if card is None:
+            raise ValueError("Action number " + str(action_number) + " is not a legal action for " + str(player) +
+                             ".")
+        return card
+
+    def get_action_name(self, action_number):
+        """Returns the same name the matching Action object would have"""
+        if action_number == 0:
+            return 'DRAW'
+        elif action_number < self.action_meld_offset:
+            action_type = 'ACHIEVE'
+        elif action_number < self.action_dogma_offset:
+            action_type = 'MELD'
+        else:
+            action_type = 'DOGMA'
+        return action_type + ' - ' + self.get_action_card(action_number).name
+
+    def execute_action_number(self, action_number):
+        """Executes an action from its number, without building Action objects"""
+        card = self.get_action_card(action_number)
+        if self.game_log.action:
+            self.game_log.event('action', "{p} chooses {s}", p=self.turn_player.name,
+                                s=self.get_action_name(action_number))
+        self.active_card = card
+        self.turn_card = card
+        self.active_player = self.turn_player
+
+        if action_number == 0:
+            self.action_draw()
+        elif action_number < self.action_meld_offset:
+            self.action_achieve()
+        elif action_number < self.action_dogma_offset:
+            self.action_meld()
+        else:
+            self.action_dogma()
+
+    def get_option_mask(self):
+        """Returns a bytearray over the whole option space, 1 for the index of every option the active player has"""
+        number_of_options = len(self.active_player.options)
+        if number_of_options > self.option_space_size:
+            raise ValueError("Too many options for the option space: " + str(number_of_options) + ".")
+        mask = bytearray(self.option_space_size)
+        mask[:number_of_options] = b'\x01' * number_of_options
+        return mask
+
+    def execute_option_number(self, option_number):
+        """Selects the active player's option at this index and executes it"""
+        if not 0 <= option_number < len(self.active_player.options):
+            raise ValueError("Option number " + str(option_number) + " is not one of the options for " +
+                             str(self.active_player) + ".")
+        self.active_player.selected_option = self.active_player.options[option_number]
+        self.active_player.selected_option_log.append(self.active_player.selected_option)
+        self.execute_option()
+
     # Humans
     def print_available_actions(self):
         print("Available actions")
@@ -1710,9 +3340,35 @@ class InnovationGame(Game):
                 break
 
     # AIs
+    def set_ai_policy(self, player_number, policy):
+        """Gives a player one of the named AI policies. Works before or after the game is created."""
+        if policy not in self.ai_policies:
+            raise ValueError("Unknown AI policy " + str(policy) + ". Policies are: " + ", ".join(self.ai_policies))
+        action_function_name, option_function_name, action_number_function_name = self.ai_policies[policy]
+        self.ai_action_functions[player_number] = getattr(self, action_function_name)
+        self.ai_option_functions[player_number] = getattr(self, option_function_name)
+        self.ai_action_number_functions[player_number] = None
+        if action_number_function_name:
+            self.ai_action_number_functions[player_number] = getattr(self, action_number_function_name)
+
+        player = self.get_player_object(player_number)
+        if player and player.ai_flag:
+            player.select_an_action = self.ai_action_functions[player_number]
+            player.select_an_option = self.ai_option_functions[player_number]
+            player.select_an_action_number = self.ai_action_number_functions[player_number]
+
+    def get_result_record(self):
+        """Compact summary of a finished game"""
+        return {'seed': self.seed,
+                'winner': self.winning_player.name if self.winning_player else None,
+                'scores': [player.get_score() for player in self.players],
+                'achievements': [player.achievement_pile.get_pile_size() for player in self.players],
+                'rounds': self.round,
+                'actions': self.action_count}
+
     def ai_select_action_random(self):
         """Baseline AI to determine which action to select by random selection"""
-        index = random.randrange(len(self.turn_player.action_options))
+        index = self.journal_random(self.turn_player.random).randrange(len(self.turn_player.action_options))
         self.turn_player.selected_action = self.turn_player.action_options[index]
 
     def ai_select_action_random_always_achieve(self):
@@ -1728,12 +3384,335 @@ class InnovationGame(Game):
             i += 1
 
         if not selection:
-            selection = random.randrange(len(self.turn_player.action_options))
+            selection = self.journal_random(self.turn_player.random).randrange(len(self.turn_player.action_options))
 
         self.turn_player.selected_action = self.turn_player.action_options[selection]
 
+    def ai_select_action_number_random(self, legal_action_numbers):
+        """Same choices as ai_select_action_random, from a list of action numbers"""
+        index = self.journal_random(self.turn_player.random).randrange(len(legal_action_numbers))
+        return legal_action_numbers[index]
+
+    def ai_select_action_number_random_always_achieve(self, legal_action_numbers):
+        """Same choices as ai_select_action_random_always_achieve, from a list of action numbers"""
+        for action_number in legal_action_numbers:
+            if self.action_achieve_offset <= action_number < self.action_meld_offset:
+                return action_number
+        return self.ai_select_action_number_random(legal_action_numbers)
+
+    def ai_select_action_number_rollout(self, legal_action_numbers):
+        """Flat Monte Carlo AI: plays random games on from each legal action in a copy of the game, and picks the
+        action that won most often. A tie counts as half a win. The starting meld and options use the random AI.
+
+        Before each round of playouts the cards the player cannot see are dealt out again at random, see determinize,
+        so the AI does not know the draw piles or the other players' hands and score piles."""
+        if len(legal_action_numbers) == 1:
+            return legal_action_numbers[0]
+
+        rollout_seed = self.journal_random(self.turn_player.random).getrandbits(64)
+        playout_game = self.get_playout_game()
+        if self.can_use_worker_pool(self.rollout_workers):
+            results = self.play_rollouts_in_pool(playout_game, legal_action_numbers, rollout_seed)
+        else:
+            results = playout_game.play_rollouts(legal_action_numbers, self.rollout_playouts,
+                                                 self.rollout_time_budget, rollout_seed)
+
+        best_index = 0
+        best_win_rate = -1
+        for i, (wins, playouts) in enumerate(results):
+            if playouts and wins / playouts > best_win_rate:
+                best_index = i
+                best_win_rate = wins / playouts
+        return legal_action_numbers[best_index]
+
+    def get_playout_game(self):
+        """Quiet clone of the game at a decision, where every player plays randomly from the clone's playout stream"""
+        playout_game = self.clone()
+        playout_game.verbose = False
+        playout_game.set_pile_state_history_retention('off')
+        for player in playout_game.players:
+            player.select_an_action = playout_game.ai_select_action_random
+            player.select_an_option = playout_game.ai_select_option_playout
+            player.select_an_action_number = playout_game.ai_select_action_number_playout
+        return playout_game
+
+    def play_rollouts(self, action_numbers, playouts, time_budget=None, seed=None):
+        """Plays random games on from each action, taken by the turn player at the decision this game is stopped at,
+        rolling back to the decision after each one. Plays the given number of playouts for each action, or as many
+        rounds of playouts as fit in the time budget. Returns [wins, playouts] for each action."""
+        self.playout_random = random.Random(seed)
+        deciding_player = self.turn_player
+        results = [[0, 0] for _ in action_numbers]
+        deadline = time.perf_counter() + time_budget if time_budget is not None else None
+
+        mark = self.start_journal()
+        playout = 0
+        while (playout < playouts) if deadline is None else (playout == 0 or time.perf_counter() < deadline):
+            # Every action is played out in the same dealing of the hidden cards
+            dealing_seed = self.playout_random.getrandbits(64)
+            for action_number, result in zip(action_numbers, results):
+                self.determinize(deciding_player, random.Random(dealing_seed))
+                self.execute_action_number(action_number)
+                self.play_rest_of_game()
+                if self.winning_player is deciding_player:
+                    result[0] += 1
+                elif self.winning_player is None:
+                    result[0] += 0.5
+                result[1] += 1
+                self.rollback_to_journal_mark(mark)
+                for player in self.players:
+                    player.selected_option_log = []
+            playout += 1
+        self.stop_journal()
+        return results
+
+    def play_rollouts_in_pool(self, playout_game, action_numbers, seed):
+        """Splits the playouts of the rollout AI over the rollout pool, each worker with its own seed, and adds up the
+        results"""
+        game_bytes = pickle.dumps(playout_game)
+        seed_generator = random.Random(seed)
+        worker_playouts = -(-self.rollout_playouts // self.rollout_workers)
+        worker_arguments = [(game_bytes, action_numbers, worker_playouts, self.rollout_time_budget,
+                             seed_generator.getrandbits(64)) for _ in range(self.rollout_workers)]
+
+        results = [[0, 0] for _ in action_numbers]
+        worker_pool = self.get_worker_pool(self.rollout_workers)
+        for worker_results in worker_pool.starmap(play_rollouts_from_bytes, worker_arguments):
+            for result, worker_result in zip(results, worker_results):
+                result[0] += worker_result[0]
+                result[1] += worker_result[1]
+        return results
+
+    def can_use_worker_pool(self, workers):
+        """True if there is more than one worker and this is not a worker process itself, which cannot start its own
+        pool. The AIs play serially otherwise."""
+        return workers > 1 and not multiprocessing.current_process().daemon
+
+    def get_worker_pool(self, workers):
+        """Returns a process pool with this many workers, kept between decisions"""
+        if self.worker_pool is not None and self.worker_pool_size != workers:
+            self.close_worker_pool()
+        if self.worker_pool is None:
+            self.worker_pool = multiprocessing.Pool(workers)
+            self.worker_pool_size = workers
+        return self.worker_pool
+
+    def close_worker_pool(self):
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+            self.worker_pool.join()
+            self.worker_pool = None
+            self.worker_pool_size = 0
+
+    def ai_select_action_number_mcts(self, legal_action_numbers):
+        """Monte Carlo tree search AI with UCB1 selection over actions and options. Picks the most visited action and
+        keeps its subtree for this player's options and next search."""
+        player = self.turn_player
+        if len(legal_action_numbers) == 1:
+            return legal_action_numbers[0]
+
+        search_seed = self.journal_random(player.random).getrandbits(64)
+        root = self.get_search_root(player, legal_action_numbers)
+        search_game = self.get_search_game()
+        if self.can_use_worker_pool(self.mcts_workers):
+            action_number = self.search_root_parallel(search_game, root, search_seed)
+        else:
+            self.search_statistics = search_game.search(root, self.mcts_iterations, self.mcts_time_budget,
+                                                        search_seed)
+            action_number = root.get_most_visited_choice()
+        if self.game_log.search:
+            self.game_log.event('search', "{p} searched {n} nodes in {i} iterations, {r:.0f} nodes per second",
+                                p=player.name, n=self.search_statistics['nodes'],
+                                i=self.search_statistics['iterations'],
+                                r=self.search_statistics['nodes_per_second'])
+
+        # A root parallel search can pick an action this process never tried, then the next search starts afresh
+        children = root.children.get(action_number)
+        if children:
+            self.search_trees[player.number] = children
+        else:
+            self.search_trees.pop(player.number, None)
+        return action_number
+
+    def search_root_parallel(self, search_game, root, seed):
+        """Root parallel tree search: the other workers search from the pickled search game while this process
+        searches root, then the visits and wins of each action are added up. Returns the most visited action.
+
+        The statistics count the nodes of every worker. The speedup over a search in a single process is measured by
+        benchmark_search_speedup."""
+        seed_generator = random.Random(seed)
+        seeds = [seed_generator.getrandbits(64) for _ in range(self.mcts_workers)]
+        game_bytes = pickle.dumps(search_game)
+        worker_pool = self.get_worker_pool(self.mcts_workers - 1)
+        worker_results = worker_pool.starmap_async(search_from_bytes, [
+            (game_bytes, root.choices, self.mcts_iterations, self.mcts_time_budget, worker_seed)
+            for worker_seed in seeds[1:]])
+
+        statistics = search_game.search(root, self.mcts_iterations, self.mcts_time_budget, seeds[0])
+        choice_visits = dict(root.choice_visits)
+        choice_wins = dict(root.choice_wins)
+        iterations = statistics['iterations']
+        nodes = statistics['nodes']
+        for worker_choice_visits, worker_choice_wins, worker_statistics in worker_results.get():
+            for choice in root.choices:
+                choice_visits[choice] += worker_choice_visits[choice]
+                choice_wins[choice] += worker_choice_wins[choice]
+            iterations += worker_statistics['iterations']
+            nodes += worker_statistics['nodes']
+
+        self.search_statistics = {'workers': self.mcts_workers,
+                                  'iterations': iterations,
+                                  'nodes': nodes,
+                                  'tree_size': statistics['tree_size'],
+                                  'seconds': statistics['seconds'],
+                                  'nodes_per_second': nodes / statistics['seconds'] if statistics['seconds'] else 0,
+                                  'choice_visits': choice_visits,
+                                  'choice_wins': choice_wins}
+        return max(root.choices, key=lambda choice: choice_visits[choice])
+
+    def ai_select_option_mcts(self):
+        """Picks the most visited option of the decision in the kept subtree, or a random option if the search did not
+        reach it"""
+        player = self.active_player
+        node = self.find_kept_node(player, self.get_option_decision_key())
+        if node is None or node.visits == 0:
+            self.ai_select_random_option()
+            return
+
+        option_number = node.get_most_visited_choice()
+        self.search_trees[player.number] = node.children.get(option_number, {})
+        player.selected_option = player.options[option_number]
+
+    def get_action_decision_key(self, legal_action_numbers):
+        return (self.get_information_state(self.turn_player), self.actions_left_in_turn,
+                tuple(legal_action_numbers))
+
+    def get_option_decision_key(self):
+        return (self.get_information_state(self.active_player),
+                tuple(option.name for option in self.active_player.options))
+
+    def find_kept_node(self, player, key):
+        """Returns the node with the key in the subtrees the player kept from its last search, or None"""
+        for node in self.search_trees.get(player.number, {}).values():
+            found_node = node.find_node(key)
+            if found_node is not None:
+                return found_node
+        return None
+
+    def get_search_root(self, player, legal_action_numbers):
+        """Returns the node of the decision in the player's kept subtrees, or a new node"""
+        key = self.get_action_decision_key(legal_action_numbers)
+        root = self.find_kept_node(player, key)
+        if root is None:
+            root = SearchNode()
+            root.set_decision(key, player.number, legal_action_numbers)
+        return root
+
+    def get_search_game(self):
+        """Quiet clone of the game at a decision, where every decision goes through the running search"""
+        search_game = self.get_playout_game()
+        for player in search_game.players:
+            player.select_an_option = search_game.search_select_option
+            player.select_an_action_number = search_game.search_select_action_number
+        return search_game
+
+    def search(self, root, iterations, time_budget=None, seed=None):
+        """Runs a Monte Carlo tree search from the decision this game is stopped at, with root as its node, rolling
+        back to the decision after each iteration. Each iteration deals the hidden cards of the player at the root out
+        again from the seed, so the tree does not fit one guess of them. Runs the given number of iterations, or as
+        many as fit in the time budget. Returns statistics of the search."""
+        self.playout_random = random.Random(seed)
+        search_player = self.get_player_object(root.player_number)
+        start_time = time.perf_counter()
+        deadline = start_time + time_budget if time_budget is not None else None
+        nodes_searched = 0
+
+        mark = self.start_journal()
+        iteration = 0
+        while (iteration < iterations) if deadline is None else (iteration == 0 or time.perf_counter() < deadline):
+            self.determinize(search_player, self.playout_random)
+            self.search_children = None
+            self.search_path = []
+            self.execute_action_number(self.search_decide(root, root.choices))
+            self.play_rest_of_game()
+
+            for node, choice in self.search_path:
+                if self.winning_player is None:
+                    reward = 0.5
+                else:
+                    reward = 1 if self.winning_player.number == node.player_number else 0
+                node.visits += 1
+                node.choice_visits[choice] += 1
+                node.choice_wins[choice] += reward
+            nodes_searched += len(self.search_path)
+
+            self.rollback_to_journal_mark(mark)
+            for player in self.players:
+                player.selected_option_log = []
+            iteration += 1
+        self.stop_journal()
+        self.search_children = None
+        self.search_path = []
+
+        seconds = time.perf_counter() - start_time
+        return {'iterations': iteration,
+                'nodes': nodes_searched,
+                'tree_size': root.count_nodes(),
+                'seconds': seconds,
+                'nodes_per_second': nodes_searched / seconds if seconds else 0}
+
+    def search_decide(self, node, choices):
+        """Choice of the running search at a decision. In the tree, tries every choice once and then picks by UCB1;
+        the first untried choice ends the walk through the tree, and the rest of the game is played randomly."""
+        if node is None:
+            return choices[self.playout_random.randrange(len(choices))]
+
+        if node.untried_choices:
+            choice = node.untried_choices.pop(self.playout_random.randrange(len(node.untried_choices)))
+            node.children[choice] = {}
+            self.search_children = None
+        else:
+            choice = node.get_ucb_choice(self.mcts_exploration)
+            self.search_children = node.children[choice]
+        self.search_path.append((node, choice))
+        return choice
+
+    def get_search_node(self, decision, player_number, choices, get_key):
+        """Returns the node the running search has reached, the child of its last choice for this decision, made the
+        first time it is reached. None once the walk has left the tree."""
+        children = self.search_children
+        if children is None:
+            return None
+        node = children.get(decision)
+        if node is None:
+            node = SearchNode()
+            node.set_decision(get_key(), player_number, choices)
+            children[decision] = node
+        return node
+
+    def search_select_action_number(self, legal_action_numbers):
+        player_number = self.turn_player.number
+        node = self.get_search_node((player_number, tuple(legal_action_numbers)), player_number, legal_action_numbers,
+                                    lambda: self.get_action_decision_key(legal_action_numbers))
+        return self.search_decide(node, legal_action_numbers)
+
+    def search_select_option(self):
+        player_number = self.active_player.number
+        option_numbers = list(range(len(self.active_player.options)))
+        decision = (player_number, tuple(option.name for option in self.active_player.options))
+        node = self.get_search_node(decision, player_number, option_numbers, self.get_option_decision_key)
+        self.active_player.selected_option = self.active_player.options[self.search_decide(node, option_numbers)]
+
+    def ai_select_action_number_playout(self, legal_action_numbers):
+        """Random AI of playouts. Its stream is not rolled back with the game, so each playout plays differently."""
+        return legal_action_numbers[self.playout_random.randrange(len(legal_action_numbers))]
+
+    def ai_select_option_playout(self):
+        index = self.playout_random.randrange(len(self.active_player.options))
+        self.active_player.selected_option = self.active_player.options[index]
+
     def ai_select_random_option(self):
-        index = random.randrange(len(self.active_player.options))
+        index = self.journal_random(self.active_player.random).randrange(len(self.active_player.options))
         self.active_player.selected_option = self.active_player.options[index]
 
     def ai_select_random_option_always_splay(self):
@@ -1748,10 +3727,12 @@ class InnovationGame(Game):
         if len(upgrade_options) == 1:
             self.active_player.selected_option = upgrade_options[0]
         elif len(upgrade_options) > 1:
-            index = random.randrange(len(upgrade_options))
+            index = self.journal_random(self.active_player.random).randrange(len(upgrade_options))
             self.active_player.selected_option = upgrade_options[index]
-        else:
+        elif self.active_player.get_pass_option():
             self.active_player.selected_option = self.active_player.get_pass_option()
+        else:
+            self.ai_select_random_option()
 
     # Options
     def take_option(self):
@@ -1763,8 +3744,9 @@ class InnovationGame(Game):
         self.active_player.selected_option_log.append(self.active_player.selected_option)
 
     def execute_option(self):
-        self.print_for_testing("{p} chooses to {s}".format(p=self.active_player.name,
-                                                           s=self.active_player.selected_option.name))
+        if self.game_log.option:
+            self.game_log.event('option', "{p} chooses to {s}", p=self.active_player.name,
+                                s=self.active_player.selected_option.name)
         self.active_player.selected_option.execute()
 
     def execute_option_draw_and_tuck(self):
@@ -2244,15 +4226,16 @@ class InnovationGame(Game):
         self.create_return_a_card_option_suite(self.active_player.hand.cards)
         self.take_option()
         if self.active_player.selected_option.type == 'return':
-            self.create_mandatory_score_a_card_option_suite(self.active_player.hand.cards)
-            self.take_option()
+            if self.active_player.hand.cards:
+                self.create_mandatory_score_a_card_option_suite(self.active_player.hand.cards)
+                self.take_option()
             self.draw_to_hand_multiple(10, 2)
 
     def genetics_effect_0(self):
         self.draw_and_meld(10)
-        active_stack = self.active_player.stacks[self.active_card.color].cards
-        if len(active_stack) > 1:
-            self.score_cards(active_stack[1:])
+        active_stack = self.active_player.stacks[self.active_card.color]
+        if active_stack.get_pile_size() > 1:
+            self.score_cards(active_stack.get_cards_under_top_card())
 
     # Age 10 effects
     def ai_effect_0(self):
@@ -2308,8 +4291,8 @@ class InnovationGame(Game):
 
     # Tests
     def print_for_testing(self, string_to_print):
-        if self.verbose:
-            print(string_to_print)
+        if self.game_log.test:
+            self.game_log.event('test', string_to_print)
 
     def create_tests(self):
         # Test name, setup function, action function, evaluation function, corresponding card
@@ -3082,7 +5065,7 @@ class InnovationGame(Game):
         if starting_stack:
             scored_correctly = self.test_score_multiple_cards(starting_stack)
         else:
-            if starting_score == self.active_player.score_pile.cards:
+            if starting_score == list(self.active_player.score_pile.cards):
                 scored_correctly = True
             else:
                 scored_correctly = False
@@ -3256,11 +5239,31 @@ class InnovationGame(Game):
             associated_effect = self.get_effect_object(self.get_card_object(test_to_add[0]), test_to_add[1])
             associated_effect.tests.append(test)
 
+        # Test name, arrange, act, assess. These tests have no card, the act function is run instead of a dogma.
+        state_tests = [['Journal rollback', self.test_state_arrange, self.test_journal_rollback_act, self.test_state_assess],
+                       ['Save and load state', self.test_state_arrange, self.test_save_load_state_act, self.test_state_assess],
+                       ['Clone', self.test_state_arrange, self.test_clone_act, self.test_state_assess],
+                       ['Pile state history', self.test_state_arrange, self.test_pile_state_history_act, self.test_state_assess],
+                       ['Reset game', self.test_state_arrange, self.test_reset_game_act, self.test_state_assess],
+                       ['AI gym workers', self.test_other_games_arrange, self.test_ai_gym_workers_act, self.test_state_assess]]
+
+        if numpy is not None:
+            state_tests.append(['State encoder', self.test_state_arrange, self.test_state_encoder_act,
+                                self.test_state_assess])
+            state_tests.append(['Environment', self.test_other_games_arrange, self.test_environment_act,
+                                self.test_state_assess])
+
+        for test_to_add in state_tests:
+            self.add_aaatest_to_game(AAATest(test_to_add[0], test_to_add[1], test_to_add[2], test_to_add[3]))
+
     def aaa_run_test(self):
         self.print_for_testing(self.active_test.name)
         self.test_build_game()
         self.active_test.setup()
-        self.aaa_test_dogma()
+        if self.active_test.card:
+            self.aaa_test_dogma()
+        else:
+            self.active_test.act()
         self.active_test.evaluate()
 
     def aaa_test_an_effect(self, card_name, effect_number, test_number):
@@ -3311,9 +5314,9 @@ class InnovationGame(Game):
                     self.set_effect_pile_state()
                     self.active_player = eligible_player
                     self.effect_player = eligible_player
-                    self.print_for_testing('{t} DEMANDS {p} resolve {c} dogma'.format(t=self.turn_player,
-                                                                                      p=eligible_player.name,
-                                                                                      c=self.turn_card.name))
+                    if self.game_log.effect:
+                        self.game_log.event('effect', '{t} DEMANDS {p} resolve {c} dogma', t=self.turn_player,
+                                            p=eligible_player.name, c=self.turn_card.name)
                     effect.activate()
 
         else:
@@ -3322,7 +5325,9 @@ class InnovationGame(Game):
                 self.set_effect_pile_state()
                 self.active_player = eligible_player
                 self.effect_player = eligible_player
-                self.print_for_testing('{p} resolves {c} dogma'.format(p=eligible_player.name, c=self.turn_card.name))
+                if self.game_log.effect:
+                    self.game_log.event('effect', '{p} resolves {c} dogma', p=eligible_player.name,
+                                        c=self.turn_card.name)
                 effect.activate()
 
                 # Only run sharing code if it's not the turn player and nobody has shared yet.
@@ -3330,7 +5335,10 @@ class InnovationGame(Game):
                     dogma_was_shared = self.check_if_opponent_shared()
 
     def test_build_game(self):
-        self.create_game()
+        if self.cards:
+            self.reset_game(self.seed)
+        else:
+            self.create_game()
         self.shuffle_piles()
         self.testing = True
 
@@ -3442,6 +5450,171 @@ class InnovationGame(Game):
     def aaa_test_game_not_over(self):
         return not self.game_over and not self.winning_player
 
+    def aaa_test_game_state(self):
+        """Pile state, splays and turn fields, by name and number so a game and its clone can be compared"""
+        return (self.get_pile_state(),
+                [stack.splay for stack in self.stacks],
+                self.round, self.action_count, self.actions_left_in_turn, self.game_over,
+                self.turn_player.number if self.turn_player else None,
+                self.winning_player.number if self.winning_player else None,
+                [player.table_position for player in self.players],
+                [player.number for player in self.ordered_players])
+
+    def aaa_test_play_quietly(self, function):
+        """Runs a function that plays part of the game with the game log off"""
+        verbose = self.verbose
+        self.verbose = False
+        function()
+        self.verbose = verbose
+
+    def aaa_test_new_game(self, seed):
+        """Creates a quiet game with the same players as this one"""
+        player_arguments = []
+        for name, ai in zip(self.player_names, self.ai_players):
+            player_arguments += [name, ai]
+        g = InnovationGame(self.name, self.date, self.number_of_players, seed, *player_arguments)
+        g.verbose = False
+        g.create_game()
+        return g
+
+    def aaa_test_start_round(self):
+        """Takes the first action of the next round, leaving the game between the first player's two actions"""
+        self.round += 1
+        self.turn_player = self.ordered_players[0]
+        self.actions_left_in_turn = 2
+        self.take_action()
+
+    # Game state tests
+    def test_state_arrange(self):
+        self.test_states = []
+        self.reset_game(12345)
+        self.set_up_game()
+        self.aaa_test_play_quietly(self.starting_play)
+        self.aaa_test_play_quietly(self.play_first_round)
+
+    def test_other_games_arrange(self):
+        # For tests that play games of their own
+        self.test_states = []
+
+    def test_state_assess(self):
+        return len(self.test_states) == 2 and self.test_states[0] == self.test_states[1]
+
+    def test_pile_state_history_act(self):
+        # A short keyframe interval, so the history is rebuilt from many keyframes
+        self.pile_state_history = PileStateHistory(self, 'full', keyframe_interval=20)
+        self.pile_state_history.take_keyframe()
+        event_numbers = []
+        snapshots = []
+        while True:
+            event_numbers.append(self.pile_state_history.event_count)
+            snapshots.append((self.get_pile_state(), {stack.name: stack.get_splay_type() for stack in self.stacks}))
+            if self.game_over:
+                break
+            self.aaa_test_play_quietly(self.play_round)
+        self.test_states.append(snapshots)
+        self.test_states.append([self.pile_state_history.rebuild(event_number) for event_number in event_numbers])
+
+    def test_reset_game_act(self):
+        self.reset_game(54321)
+        self.set_up_game()
+        self.aaa_test_play_quietly(self.play_game)
+        new_game = self.aaa_test_new_game(54321)
+        new_game.set_up_game()
+        new_game.play_game()
+        self.test_states.append(self.aaa_test_game_state())
+        self.test_states.append(new_game.aaa_test_game_state())
+
+    def test_ai_gym_workers_act(self):
+        self.test_states.append(run_ai_gym(8, 12345, workers=1))
+        self.test_states.append(run_ai_gym(8, 12345, workers=2))
+
+    def test_state_encoder_act(self):
+        for _ in range(8):
+            self.aaa_test_play_quietly(self.play_round)
+        # The AIs seldom splay, so splay the stacks that have more than one card, in turn in each direction
+        splayable_stacks = [stack for stack in self.stacks if stack.get_pile_size() > 1]
+        for stack, splay_direction in zip(splayable_stacks, itertools.cycle(['left', 'right', 'up'])):
+            stack.set_splay(splay_direction)
+        encoder = self.get_state_encoder()
+        arrays = encoder.allocate(len(self.players))
+        encoder.encode_states([self.save_state()] * len(self.players), range(len(self.players)), arrays)
+        expected = []
+        encoded = []
+        for perspective_player in self.players:
+            # Players are ordered from the perspective player
+            players = [self.get_player_object((perspective_player.number + i) % len(self.players))
+                       for i in range(len(self.players))]
+            expected.append(([list(player.icon_totals) for player in players],
+                             [player.get_score() for player in players],
+                             [[self.card_numbers[stack.see_top_card().name] + 1 if stack.see_top_card() else 0
+                               for stack in player.stacks] for player in players],
+                             [[stack.splay for stack in player.stacks] for player in players]))
+            number = perspective_player.number
+            encoded.append((arrays['icons'][number].tolist(), arrays['scores'][number].tolist(),
+                            arrays['top_cards'][number].tolist(), arrays['splays'][number].tolist()))
+        self.test_states.append(expected)
+        self.test_states.append(encoded)
+
+    def test_environment_act(self):
+        environment = InnovationEnvironment((None, 'random'), encode_observations=False)
+        choice_random = random.Random(12345)
+        choices = []
+        environment.reset(12345)
+        done = False
+        while not done:
+            choices.append(choice_random.choice(environment.legal_choices))
+            done = environment.step(choices[-1])[3]
+
+        # The same game played by play_game, with the first player making the same choices
+        g = create_simulation_game(['random', 'random'])
+        player = g.get_player_object(0)
+        replayed_choices = iter(choices)
+
+        def select_action():
+            meld_numbers = [g.action_meld_offset + g.card_numbers[action.card.name]
+                            for action in player.action_options]
+            player.selected_action = player.action_options[meld_numbers.index(next(replayed_choices))]
+
+        def select_option():
+            player.selected_option = player.options[0 if g.game_over else next(replayed_choices)]
+
+        player.select_an_action = select_action
+        player.select_an_action_number = lambda legal_action_numbers: next(replayed_choices)
+        player.select_an_option = select_option
+        g.reset_game(12345)
+        g.set_up_game()
+        g.play_game()
+        self.test_states.append((environment.game.aaa_test_game_state(), []))
+        self.test_states.append((g.aaa_test_game_state(), list(replayed_choices)))
+
+    def test_journal_rollback_act(self):
+        self.aaa_test_play_quietly(self.aaa_test_start_round)
+        mark = self.start_journal()
+        self.test_states.append(self.aaa_test_game_state())
+        self.aaa_test_play_quietly(self.take_action)
+        self.aaa_test_play_quietly(self.play_round)
+        self.rollback_to_journal_mark(mark)
+        self.test_states.append(self.aaa_test_game_state())
+        self.stop_journal()
+
+    def test_save_load_state_act(self):
+        self.aaa_test_play_quietly(self.play_round)
+        self.aaa_test_play_quietly(self.aaa_test_start_round)
+        state = self.save_state()
+        self.test_states.append(self.aaa_test_game_state())
+        self.aaa_test_play_quietly(self.take_action)
+        self.aaa_test_play_quietly(self.play_round)
+        self.load_state(state)
+        self.test_states.append(self.aaa_test_game_state())
+
+    def test_clone_act(self):
+        self.aaa_test_play_quietly(self.aaa_test_start_round)
+        clone = self.clone()
+        clone.aaa_test_play_quietly(clone.play_rest_of_game)
+        self.aaa_test_play_quietly(self.play_rest_of_game)
+        self.test_states.append(self.aaa_test_game_state())
+        self.test_states.append(clone.aaa_test_game_state())
+
     # Age 1 tests
     def test_agriculture_0_arrange(self):
         self.active_player = self.get_player_object(0)
@@ -3916,34 +6089,412 @@ class InnovationGame(Game):
         return self.aaa_test_score_from_hand_option(self.get_player_object(0), card_list)
 
 
-def ai_gym():
-    number_of_runs = int(input('Enter number of runs: '))
+class DecisionPending(Exception):
+    """Raised by an InnovationEnvironment player at a decision the caller has not made yet"""
+
+
+class InnovationEnvironment:
+    """Step and reset interface to a game of Innovation that stops at every decision of the players with policy None.
+    Observations are StateEncoder arrays, filled in place, or save_state bytes without encode_observations. Each step
+    replays the current action, so 'rollout' and 'mcts' opponents run their whole search again on every step."""
+
+    def __init__(self, policies=(None, None), encode_observations=True):
+        self.policies = list(policies)
+        if None not in self.policies:
+            raise ValueError("Could not create environment with policies " + str(self.policies) +
+                             ". At least one player must be controlled by the caller, with policy None.")
+        self.encode_observations = encode_observations
+        self.game = create_simulation_game(['random'] * len(self.policies))
+        for number, policy in enumerate(self.policies):
+            player = self.game.get_player_object(number)
+            if policy is not None:
+                self.game.set_ai_policy(number, policy)
+            else:
+                player.select_an_action = self.select_action
+                player.select_an_action_number = self.select_action_number
+                player.select_an_option = self.select_option
+
+        self.encoder = self.game.get_state_encoder()
+        self.observation = self.encoder.allocate(1)
+        self.mask = numpy.zeros(self.game.decision_space_size, dtype=numpy.uint8)
+        self.steps = None
+
+        # Choices made so far in the current segment, the decisions they were made at, and how many of them the replay
+        # has used
+        self.choices = []
+        self.choice_decisions = []
+        self.choices_used = 0
+
+        # The decision the game is stopped at
+        self.player = None
+        self.decision = None
+        self.legal_choices = []
+        self.state = None
+        self.done = True
+
+    # Decision kinds, as in TrajectoryRecorder
+    action_decision = 0
+    option_decision = 1
+
+    def reset(self, seed=None):
+        """Starts a new game, returns the observation and mask of the first decision"""
+        self.game.reset_game(seed)
+        self.game.set_up_game()
+        self.steps = self.play_steps()
+        self.done = False
+        self.player = None
+        next(self.steps, None)
+        return self.get_observation(), self.get_mask()
+
+    def step(self, choice):
+        """Makes the choice at the current decision. Returns the next observation and mask, the reward of each player
+        (1 win, 0.5 tie, 0 loss once the game is done, 0 before), and whether the game is done."""
+        if self.done:
+            raise ValueError("Could not step. The game is done, call reset.")
+        if choice not in self.legal_choices:
+            raise ValueError("Could not step. " + str(choice) + " is not a legal choice.")
+
+        try:
+            self.steps.send(choice)
+        except StopIteration:
+            self.done = True
+            self.legal_choices = []
+            self.state = self.game.save_state()
+
+        if self.done:
+            rewards = [self.get_reward(player) for player in self.game.players]
+        else:
+            rewards = [0] * len(self.game.players)
+        return self.get_observation(), self.get_mask(), rewards, self.done
+
+    def get_reward(self, player):
+        if self.game.winning_player is None:
+            return 0.5
+        return 1 if self.game.winning_player is player else 0
+
+    def get_observation(self):
+        if not self.encode_observations:
+            return self.state
+        self.encoder.encode_states([self.state], [self.player.number], self.observation)
+        return self.observation
+
+    def get_mask(self):
+        self.mask[:] = 0
+        self.mask[self.legal_choices] = 1
+        return self.mask
+
+    def play_steps(self):
+        """Generator that plays the game as play_game does, one segment at a time, and yields at every decision"""
+        g = self.game
+        yield from self.play_segment(g.starting_play)
+        while not g.game_over:
+            g.round += 1
+            for player in list(g.ordered_players):
+                g.turn_player = player
+                g.actions_left_in_turn = g.get_number_of_actions_in_turn(player)
+                while g.actions_left_in_turn > 0 and not g.game_over:
+                    yield from self.play_segment(g.take_action)
+
+    def play_segment(self, function):
+        """Runs the function, rolling it back and yielding for a choice whenever it reaches a new decision. Effects
+        cannot be paused inside the engine, so the function is replayed with the choices made so far after each one."""
+        g = self.game
+        mark = g.start_journal()
+        self.choices = []
+        self.choice_decisions = []
+        while True:
+            self.choices_used = 0
+            try:
+                function()
+                return
+            except DecisionPending:
+                g.rollback_to_journal_mark(mark)
+                for player in g.players:
+                    player.selected_option_log = []
+            self.choice_decisions.append((self.player.number, self.decision, self.legal_choices, self.state))
+            self.choices.append((yield))
+
+    def decide(self, player, decision, legal_choices):
+        """Returns the next choice of the segment being replayed, or stops the game at this decision. Raises an error
+        if the replay reaches a decision other than the one the choice was made at."""
+        if self.choices_used < len(self.choices):
+            if (player.number, decision, list(legal_choices), self.game.save_state()) != \
+                    self.choice_decisions[self.choices_used]:
+                raise ValueError("Could not replay choice " + str(self.choices[self.choices_used]) +
+                                 ". The game reached a different decision than the one it was made at.")
+            self.choices_used += 1
+            return self.choices[self.choices_used - 1]
+
+        self.player = player
+        self.decision = decision
+        self.legal_choices = list(legal_choices)
+        self.state = self.game.save_state()
+        raise DecisionPending()
+
+    def select_action(self):
+        """Starting meld, chosen as the meld action of the card"""
+        g = self.game
+        player = g.turn_player
+        meld_numbers = [g.action_meld_offset + g.card_numbers[action.card.name] for action in player.action_options]
+        choice = self.decide(player, self.action_decision, meld_numbers)
+        player.selected_action = player.action_options[meld_numbers.index(choice)]
+
+    def select_action_number(self, legal_action_numbers):
+        return self.decide(self.game.turn_player, self.action_decision, legal_action_numbers)
+
+    def select_option(self):
+        player = self.game.active_player
+        if self.game.game_over:
+            player.selected_option = player.options[0]
+            return
+        player.selected_option = player.options[self.decide(player, self.option_decision,
+                                                            range(len(player.options)))]
+
+
+class VectorInnovationEnvironment:
+    """Many InnovationEnvironment games stepped in lockstep, with the observations and masks of all of them in one
+    batch. A game that finishes is reset with the next seed and its result record kept in finished_records."""
+
+    def __init__(self, number_of_games, policies=(None, None)):
+        self.environments = [InnovationEnvironment(policies, encode_observations=False)
+                             for _ in range(number_of_games)]
+        game = self.environments[0].game
+        self.encoder = game.get_state_encoder()
+        self.observations = self.encoder.allocate(number_of_games)
+        self.states = numpy.zeros((number_of_games, self.encoder.state_size), dtype=numpy.uint8)
+        self.masks = numpy.zeros((number_of_games, game.decision_space_size), dtype=numpy.uint8)
+        self.players = numpy.zeros(number_of_games, dtype=numpy.int8)
+        self.decisions = numpy.zeros(number_of_games, dtype=numpy.int8)
+        self.rewards = numpy.zeros((number_of_games, len(game.players)), dtype=numpy.float32)
+        self.dones = numpy.zeros(number_of_games, dtype=bool)
+        self.seed_generator = None
+        self.finished_records = []
+
+    def reset(self, master_seed=None):
+        """Starts a new game in every slot, with seeds derived from the master seed as in get_simulation_seeds.
+        Returns the observations and masks."""
+        self.seed_generator = random.Random(master_seed)
+        self.finished_records = []
+        for number, environment in enumerate(self.environments):
+            environment.reset(self.get_next_seed())
+            self.set_decision(number, environment)
+        return self.get_observations(), self.masks
+
+    def step(self, choices):
+        """Makes one choice in every game. Returns the observations and masks of the next decisions, the rewards of
+        each game by player number, and which games finished (and were reset)."""
+        for number, environment in enumerate(self.environments):
+            _, _, rewards, done = environment.step(int(choices[number]))
+            self.rewards[number] = rewards
+            self.dones[number] = done
+            if done:
+                self.finished_records.append(environment.game.get_result_record())
+                environment.reset(self.get_next_seed())
+            self.set_decision(number, environment)
+        return self.get_observations(), self.masks, self.rewards, self.dones
+
+    def play(self, policy, number_of_games, master_seed=None):
+        """Steps every game with a batched policy, called as policy(observations, masks, players, decisions) and
+        returning one choice per game, until number_of_games have finished. Returns the result records of the first
+        number_of_games to finish, so short games are a little overrepresented when number_of_games is small."""
+        observations, masks = self.reset(master_seed)
+        while len(self.finished_records) < number_of_games:
+            observations, masks, _, _ = self.step(policy(observations, masks, self.players, self.decisions))
+        return self.finished_records[:number_of_games]
+
+    def get_next_seed(self):
+        return self.seed_generator.randint(0, 9999999999)
+
+    def set_decision(self, number, environment):
+        self.states[number] = numpy.frombuffer(environment.state, dtype=numpy.uint8)
+        self.players[number] = environment.player.number
+        self.decisions[number] = environment.decision
+        self.masks[number] = 0
+        self.masks[number, environment.legal_choices] = 1
+
+    def get_observations(self):
+        self.encoder.encode_states(self.states, self.players, self.observations)
+        return self.observations
+
+
+def get_random_masked_choices(masks, generator):
+    """Batched random policy: one legal choice for each row of the masks, picked uniformly with a NumPy generator"""
+    return (generator.random(masks.shape) * masks).argmax(axis=1)
+
+
+def create_simulation_game(policies, profile_effects=False, record_directory=None, record_prefix='trajectories'):
+    """Creates a quiet game with one AI player for each policy name. With a record directory, the game records every
+    decision into shards there, see InnovationGame.set_trajectory_recording."""
+    player_arguments = []
+    for i in range(4):
+        player_arguments += ["Player " + str(i + 1), i < len(policies)]
+    g = InnovationGame('simulation', '2022-04-25', len(policies), None, *player_arguments)
+    for i, policy in enumerate(policies):
+        g.set_ai_policy(i, policy)
+    g.verbose = False
+    g.set_pile_state_history_retention('off')
+    g.create_game()
+    g.set_effect_profiling(profile_effects)
+    if record_directory is not None:
+        g.set_trajectory_recording(record_directory, record_prefix)
+    return g
+
+
+def get_simulation_seeds(number_of_games, seed_source=None):
+    """Returns an iterator over one seed per game. The seed source is either a master seed (int, random if None)
+    that the game seeds are derived from, or an iterable of game seeds."""
+    if seed_source is None:
+        seed_source = random.randint(0, 9999999999)
+    if isinstance(seed_source, int):
+        seed_generator = random.Random(seed_source)
+        return (seed_generator.randint(0, 9999999999) for _ in range(number_of_games))
+    return itertools.islice(seed_source, number_of_games)
+
+
+def get_chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def play_rollouts_from_bytes(game_bytes, action_numbers, playouts, time_budget, seed):
+    """Worker side of InnovationGame.play_rollouts_in_pool"""
+    g = pickle.loads(game_bytes)
+    return g.play_rollouts(action_numbers, playouts, time_budget, seed)
+
+
+def search_from_bytes(game_bytes, legal_action_numbers, iterations, time_budget, seed):
+    """Worker side of InnovationGame.search_root_parallel, returns the visits and wins of each action and the
+    statistics of the search"""
+    g = pickle.loads(game_bytes)
+    root = SearchNode()
+    root.set_decision(g.get_action_decision_key(legal_action_numbers), g.turn_player.number, legal_action_numbers)
+    statistics = g.search(root, iterations, time_budget, seed)
+    return root.choice_visits, root.choice_wins, statistics
+
+
+def load_trajectories(directory):
+    """Returns a list with a read only memory mapped record array for each shard of recorded trajectories in the
+    directory, in the order of the index files and their shards. The shards are not joined, so nothing is read until
+    it is used; numpy.concatenate joins them into one array in memory. Fields are named as in TrajectoryRecorder."""
+    shards = []
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith('-index.json'):
+            continue
+        with open(os.path.join(directory, file_name), 'r') as handle:
+            index = json.load(handle)
+        for shard in index['shards']:
+            shards.append(numpy.load(os.path.join(directory, shard['file']), mmap_mode='r')[:shard['records']])
+    return shards
+
+
+def play_simulation_game(g, seed):
+    g.reset_game(seed)
+    g.set_up_game()
+    g.play_game()
+    record = g.get_result_record()
+    if g.effect_profiler and g.effect_profiler.enabled:
+        record['effect_profile'] = g.effect_profiler.rows
+        g.effect_profiler.reset()
+    return record
+
+
+def play_simulation_games(policies, seeds, profile_effects=False, record_directory=None,
+                          record_prefix='trajectories'):
+    """Plays one game for each seed in a single game object, returns the result records"""
+    g = create_simulation_game(policies, profile_effects, record_directory, record_prefix)
+    records = [play_simulation_game(g, seed) for seed in seeds]
+    g.set_trajectory_recording(None)
+    g.close_worker_pool()
+    return records
+
+
+def simulate_games(number_of_games, policies=('random', 'always achieve'), seed_source=None, workers=1,
+                   chunk_size=20, profile_effects=False, record_directory=None):
+    """Plays AI games and yields a result record for each one as it finishes. Policies name the AI policy of each
+    player (see InnovationGame.ai_policies). With more than one worker, chunks of games are played in a process
+    pool; records still come back in seed order, so the results do not depend on the number of workers. Only a few
+    chunks are in flight at once, so callers can stop early or run an unbounded seed source.
+    With profile_effects, each record also has the game's effect profiler rows under 'effect_profile'.
+    With a record directory, every decision is recorded there as training data, see load_trajectories. Each chunk
+    played in the pool writes its own shards and index."""
+    if not isinstance(workers, int) or workers < 1:
+        raise ValueError("Number of workers must be an int of at least 1")
+    policies = list(policies)
+    seeds = get_simulation_seeds(number_of_games, seed_source)
+
+    if workers == 1:
+        g = create_simulation_game(policies, profile_effects, record_directory)
+        try:
+            for seed in seeds:
+                yield play_simulation_game(g, seed)
+        finally:
+            g.set_trajectory_recording(None)
+            g.close_worker_pool()
+        return
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = deque()
+        for chunk_number, chunk in enumerate(get_chunks(seeds, chunk_size)):
+            record_prefix = 'trajectories-' + str(chunk_number).zfill(6)
+            pending.append(pool.apply_async(play_simulation_games, (policies, chunk, profile_effects,
+                                                                    record_directory, record_prefix)))
+            if len(pending) >= 2 * workers:
+                for record in pending.popleft().get():
+                    yield record
+        while pending:
+            for record in pending.popleft().get():
+                yield record
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def run_ai_gym(number_of_runs, master_seed=None, workers=1, show_progress=False, effect_profiler=None,
+               record_directory=None):
+    """Plays number_of_runs games between the default AIs, returns the number of wins for each player name, and ties.
+    Each game's seed is derived from the master seed, so the tallies do not depend on the number of workers.
+    If an effect profiler is given, the games are profiled and every game's rows are merged into it. If a record
+    directory is given, every decision is recorded there as training data."""
+    winners = {}
     run_number = 0
-    winners = []
     percent_complete = 0
-    while run_number < number_of_runs:
-        g = InnovationGame('test', '2022-04-25', 2, None,
-                           "Player 1", True,
-                           "Player 2", True,
-                           'Player 3', True,
-                           "Player 4", True)
-        g.verbose = False
-        g.create_game()
-        g.set_up_game()
-        g.play_game()
-        if g.winning_player:
-            winners.append(g.winning_player.name)
-        else:
-            winners.append('tie')
+    for record in simulate_games(number_of_runs, seed_source=master_seed, workers=workers,
+                                 profile_effects=effect_profiler is not None, record_directory=record_directory):
+        winner = record['winner'] or 'tie'
+        winners[winner] = winners.get(winner, 0) + 1
+        if effect_profiler is not None:
+            effect_profiler.merge(record['effect_profile'])
         run_number += 1
         new_percent_complete = int(run_number // (number_of_runs / 100))
         if new_percent_complete > percent_complete:
             percent_complete = new_percent_complete
-        print("\r{r}%".format(r=percent_complete), end="")
+        if show_progress:
+            print("\r{r}%".format(r=percent_complete), end="")
+    return winners
 
-    player_1 = winners.count('Player 1')
-    player_2 = winners.count('Player 2')
-    ties = winners.count('tie')
+
+def ai_gym():
+    number_of_runs = int(input('Enter number of runs: '))
+    workers = input('Enter number of worker processes (blank for all cores): ')
+    workers = int(workers) if workers else multiprocessing.cpu_count()
+    master_seed = input('Enter master seed (blank for random): ')
+    master_seed = int(master_seed) if master_seed else random.randint(0, 9999999999)
+    effect_profiler = None
+    if input('Profile card effects (y/n): ') == 'y':
+        effect_profiler = EffectProfiler(None)
+    record_directory = input('Record trajectories to directory (blank for none): ') or None
+    print("Master seed: {s}".format(s=master_seed))
+    winners = run_ai_gym(number_of_runs, master_seed, workers, show_progress=True, effect_profiler=effect_profiler,
+                         record_directory=record_directory)
+
+    player_1 = winners.get('Player 1', 0)
+    player_2 = winners.get('Player 2', 0)
+    ties = winners.get('tie', 0)
     print("\nWin Percentages:")
     print("Mookifer {m}%".format(m=(100 * player_1 / number_of_runs)))
     print("Debbie   {m}%".format(m=(100 * player_2 / number_of_runs)))
@@ -3954,6 +6505,11 @@ def ai_gym():
     print("Mookifer {m}%".format(m=(round((100 * player_1 / won_runs), 2))))
     print("Debbie   {m}%".format(m=(round((100 * player_2 / won_runs), 2))))
 
+    if effect_profiler is not None:
+        print("\nEffect profile:")
+        for line in effect_profiler.get_table():
+            print(line)
+
 
 def play_innovation_game():
     player_list = [['Player 1', True], ['Player 2', True], ['Player 3', True], ['Player 4', True]]
@@ -3982,6 +6538,7 @@ def play_innovation_game():
                        player_list[1][0], player_list[1][1],
                        player_list[2][0], player_list[2][1],
                        player_list[3][0], player_list[3][1])
+    g.set_pile_state_history_retention('full')
     g.create_game()
     g.set_up_game()
     g.print_card_locations()
@@ -3991,10 +6548,11 @@ def play_innovation_game():
 def test_innovation():
     number_of_tests = int(input('How many tests to run: '))
     i = 0
+    g = InnovationGame('test', '2022-04-25', 2, None, "Player 1", True, "Player 2", True, 'Player 3', True, "Player 4", True)
+    g.create_game()
+    g.aaa_create_tests()
     while i < number_of_tests:
-        g = InnovationGame('test', '2022-04-25', 2, None, "Player 1", True, "Player 2", True, 'Player 3', True, "Player 4", True)
-        g.create_game()
-        g.aaa_create_tests()
+        g.reset_game()
         results = g.aaa_run_all_tests()
         i = i + 1
 
@@ -4010,10 +6568,11 @@ def test_innovation_effect():
     number_of_tests = int(input('How many tests to run: '))
     i = 0
     results = []
+    g = InnovationGame('test', '2022-04-25', 2, None, "Player 1", True, "Player 2", True, 'Player 3', True, "Player 4", True)
+    g.create_game()
+    g.aaa_create_tests()
     while i < number_of_tests:
-        g = InnovationGame('test', '2022-04-25', 2, None, "Player 1", True, "Player 2", True, 'Player 3', True, "Player 4", True)
-        g.create_game()
-        g.aaa_create_tests()
+        g.reset_game()
         results.append(g.aaa_test_an_effect(card_name, effect_number, test_number))
         i = i + 1
 
@@ -4022,6 +6581,223 @@ def test_innovation_effect():
     print('All tests passed: ' + str(all(results)))
 
 
+def get_benchmark_statistics(values, higher_is_better, unit):
+    return {'mean': statistics.mean(values),
+            'min': min(values),
+            'max': max(values),
+            'stdev': statistics.stdev(values) if len(values) > 1 else 0.0,
+            'repeats': len(values),
+            'unit': unit,
+            'higher_is_better': higher_is_better}
+
+
+def add_call_timer(g, function_name, call_times):
+    """Replaces one of the game's functions with a version that records how long each call takes"""
+    function = getattr(g, function_name)
+
+    def timed_function(*args):
+        start = time.perf_counter()
+        result = function(*args)
+        call_times.append(time.perf_counter() - start)
+        return result
+
+    setattr(g, function_name, timed_function)
+
+
+def benchmark_games(seeds):
+    """Plays a game for each seed, returns games per second and actions per second, timing only play_game"""
+    g = create_simulation_game(['random', 'always achieve'])
+    play_time = 0
+    actions = 0
+    for seed in seeds:
+        g.reset_game(seed)
+        g.set_up_game()
+        start = time.perf_counter()
+        g.play_game()
+        play_time += time.perf_counter() - start
+        actions += g.action_count
+    return len(seeds) / play_time, actions / play_time
+
+
+def benchmark_calls(seeds):
+    """Plays a game for each seed with timers on the busiest game functions, returns the mean time per call of each
+    function that was called. The AIs take actions by number and never list them, so available_actions and the pile
+    state are timed on the position at the start of every action, outside of the take_action timer."""
+    g = create_simulation_game(['random', 'always achieve'])
+    call_times = {'take_action': [], 'execute_dogma': [], 'available_actions': [], 'get_legal_action_numbers': [],
+                  'execute_action_number': [], 'get_pile_state': []}
+    add_call_timer(g, 'execute_dogma', call_times['execute_dogma'])
+    add_call_timer(g, 'get_legal_action_numbers', call_times['get_legal_action_numbers'])
+    add_call_timer(g, 'execute_action_number', call_times['execute_action_number'])
+    add_call_timer(g, 'take_action', call_times['take_action'])
+    take_action = g.take_action
+
+    def take_action_after_position_calls():
+        start = time.perf_counter()
+        g.available_actions()
+        call_times['available_actions'].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        g.get_pile_state()
+        call_times['get_pile_state'].append(time.perf_counter() - start)
+        take_action()
+
+    g.take_action = take_action_after_position_calls
+    for seed in seeds:
+        g.reset_game(seed)
+        g.set_up_game()
+        g.play_game()
+    return {function_name: statistics.mean(times) for function_name, times in call_times.items() if times}
+
+
+def benchmark_game_creation(seeds):
+    """Creates and sets up a new game for each seed, returns the mean time per game"""
+    start = time.perf_counter()
+    for seed in seeds:
+        g = InnovationGame('benchmark', '2022-04-25', 2, seed, "Player 1", True, "Player 2", True)
+        g.verbose = False
+        g.create_game()
+        g.set_up_game()
+    return (time.perf_counter() - start) / len(seeds)
+
+
+def run_benchmarks(number_of_games=200, repeats=5, master_seed=12345):
+    """Runs every benchmark repeats times on the same fixed seeds, returns the statistics for each measurement"""
+    seeds = list(get_simulation_seeds(number_of_games, master_seed))
+    measurements = {'games_per_second': [], 'actions_per_second': [], 'game_creation_ms': []}
+    call_function_names = ['take_action', 'execute_dogma', 'available_actions', 'get_legal_action_numbers',
+                           'execute_action_number', 'get_pile_state']
+    for function_name in call_function_names:
+        measurements[function_name + '_us'] = []
+
+    for _ in range(repeats):
+        games_per_second, actions_per_second = benchmark_games(seeds)
+        measurements['games_per_second'].append(games_per_second)
+        measurements['actions_per_second'].append(actions_per_second)
+        call_times = benchmark_calls(seeds)
+        for function_name in call_function_names:
+            if function_name in call_times:
+                measurements[function_name + '_us'].append(1000000 * call_times[function_name])
+        measurements['game_creation_ms'].append(1000 * benchmark_game_creation(seeds[:50]))
+
+    results = {}
+    for name in measurements:
+        if not measurements[name]:
+            continue
+        if name.endswith('_per_second'):
+            results[name] = get_benchmark_statistics(measurements[name], True, name.replace('_per_second', '/s'))
+        else:
+            results[name] = get_benchmark_statistics(measurements[name], False, name.rsplit('_', 1)[1])
+    return {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'games': number_of_games,
+            'repeats': repeats,
+            'master_seed': master_seed,
+            'results': results}
+
+
+def save_benchmark_results(benchmark, file_name):
+    directory = os.path.dirname(file_name)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(file_name, 'w') as file:
+        json.dump(benchmark, file, indent=2)
+
+
+def load_benchmark_results(file_name):
+    with open(file_name) as file:
+        return json.load(file)
+
+
+def compare_benchmark_results(benchmark, baseline, tolerance=0.1):
+    """Compares the mean of each measurement with the baseline. Returns a row for each measurement with the change
+    as a fraction of the baseline (positive is faster), and whether it is slower than the tolerance allows. A
+    measurement of the baseline that is missing from the results has no current value or change and counts as
+    slower."""
+    rows = []
+    for name in baseline['results']:
+        previous = baseline['results'][name]['mean']
+        if name not in benchmark['results']:
+            rows.append((name, previous, None, None, True))
+            continue
+        current = benchmark['results'][name]['mean']
+        if benchmark['results'][name]['higher_is_better']:
+            change = (current - previous) / previous
+        else:
+            change = (previous - current) / previous
+        rows.append((name, previous, current, change, change < -tolerance))
+    return rows
+
+
+def benchmark_search_speedup(workers, time_budget=0.1, number_of_games=2, master_seed=12345):
+    """Plays games with a tree search AI against the random AI at a fixed deadline per move, first searching in a
+    single process and then root parallel over the workers. Returns the nodes searched per second of each, by the
+    wall clock time of the whole decision, and the speedup."""
+    seeds = list(get_simulation_seeds(number_of_games, master_seed))
+    nodes_per_second = []
+    for number_of_workers in (1, workers):
+        g = create_simulation_game(['mcts', 'random'])
+        g.mcts_time_budget = time_budget
+        g.mcts_workers = number_of_workers
+        totals = [0, 0]
+
+        def select_action_number(legal_action_numbers, g=g, totals=totals):
+            g.search_statistics = None
+            start = time.perf_counter()
+            action_number = g.ai_select_action_number_mcts(legal_action_numbers)
+            seconds = time.perf_counter() - start
+            if g.search_statistics:
+                totals[0] += g.search_statistics['nodes']
+                totals[1] += seconds
+            return action_number
+
+        g.get_player_object(0).select_an_action_number = select_action_number
+        for seed in seeds:
+            play_simulation_game(g, seed)
+        g.close_worker_pool()
+        nodes_per_second.append(totals[0] / totals[1])
+    return nodes_per_second[0], nodes_per_second[1], nodes_per_second[1] / nodes_per_second[0]
+
+
+def benchmark_tree_search():
+    workers = int(input('Workers: '))
+    time_budget = float(input('Seconds per move: '))
+    single, parallel, speedup = benchmark_search_speedup(workers, time_budget)
+    print("Single process {s:.0f} nodes per second".format(s=single))
+    print("{w} workers {p:.0f} nodes per second, speedup {x:.2f}".format(w=workers, p=parallel, x=speedup))
+
+
+def benchmark_innovation():
+    baseline_file_name = 'benchmarks/baseline.json'
+    results_file_name = 'benchmarks/latest.json'
+    number_of_games = int(input('Games per repeat: '))
+    repeats = int(input('Repeats: '))
+    benchmark = run_benchmarks(number_of_games, repeats)
+    save_benchmark_results(benchmark, results_file_name)
+    print("Results saved to " + results_file_name)
+
+    for name, result in benchmark['results'].items():
+        print("{n:<22} {m:>12.2f} {u:<10} stdev {s:.2f}".format(n=name, m=result['mean'], u=result['unit'],
+                                                                s=result['stdev']))
+
+    if not os.path.exists(baseline_file_name):
+        save_benchmark_results(benchmark, baseline_file_name)
+        print("No baseline found, saved these results as the baseline in " + baseline_file_name)
+        return
+
+    baseline = load_benchmark_results(baseline_file_name)
+    print("\nCompared with the baseline from " + baseline['date'])
+    slower = False
+    for name, previous, current, change, is_slower in compare_benchmark_results(benchmark, baseline):
+        if current is None:
+            print("{n:<22} {p:>12.2f} {m:>12}".format(n=name, p=previous, m='MISSING'))
+        else:
+            print("{n:<22} {p:>12.2f} {c:>12.2f} {ch:>+8.1%}{f}".format(n=name, p=previous, c=current, ch=change,
+                                                                        f='  SLOWER' if is_slower else ''))
+        slower = slower or is_slower
+    if slower:
+        print("Slower than the baseline, or measurements are missing")
+
+
 def main():
     while True:
         main_option_string = "-----------\n" \
@@ -4031,6 +6807,8 @@ def main():
                              "3 | ai gym\n" \
                              "4 | test all cards\n" \
                              "5 | test an effect\n" \
+                             "6 | benchmark\n" \
+                             "7 | benchmark tree search\n" \
                              "Selection: "
         selection = int(input(main_option_string))
         if selection == 1:
@@ -4043,6 +6821,10 @@ def main():
             test_innovation()
         elif selection == 5:
             test_innovation_effect()
+        elif selection == 6:
+            benchmark_innovation()
+        elif selection == 7:
+            benchmark_tree_search()
 
 
 if __name__ == "__main__":